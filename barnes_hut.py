@@ -0,0 +1,196 @@
+import time
+import numpy as np
+
+G = 6.674e-11           # 6.674*10^(−11) N*(m/kg)^2
+
+# Offsets of the eight octants of a node, in units of the node half size
+OCTANT_OFFSETS = np.array([[(k >> d & 1)*2 - 1 for d in range(3)] for k in range(8)])
+
+class Octree():
+    """Octree over the positions r_array (N,3) with masses m_array (N,). Every
+    node stores its total mass, center of mass, geometric center and half
+    size. Nodes with at most leaf_size objects are leaves, their objects are
+    order[leaf_start[node]:leaf_start[node]+leaf_count[node]].
+
+    The tree is built one level at a time, with all nodes of a level split
+    in one vectorized pass."""
+
+    def __init__(self, r_array, m_array, leaf_size = 16, max_depth = 32):
+        N = len(r_array)
+        r_min, r_max = np.min(r_array, axis=0), np.max(r_array, axis=0)
+        half_size = np.max(r_max - r_min)/2*(1 + 1e-9) + 1e-9
+        centers = [((r_min + r_max)/2)[np.newaxis]]
+        half_sizes = [np.array([half_size])]
+        children = [np.full((1,8), -1)]
+
+        node = np.zeros(N, dtype=int)       # deepest node of every object
+        # (object, node) pairs of all levels, to sum up masses
+        pair_objects, pair_nodes = [np.arange(N)], [node.copy()]
+        level_objects = np.arange(N)        # objects in the current level
+        first_node, nr_of_nodes = 0, 1
+        for depth in range(max_depth):
+            level_size = nr_of_nodes - first_node
+            local = node[level_objects] - first_node
+            counts = np.bincount(local, minlength=level_size)
+            split = counts > leaf_size
+            level_objects = level_objects[split[local]]
+            if len(level_objects) == 0: break
+            parents = node[level_objects]
+            octants = ((r_array[level_objects] > np.concatenate(centers)[parents])
+                    @ np.array([1,2,4]))
+            keys, new_nodes = np.unique(parents*8 + octants, return_inverse=True)
+            new_nodes = new_nodes.reshape(-1) + nr_of_nodes
+            key_parents, key_octants = keys // 8, keys % 8
+            # the nodes of this level are stored last, index them locally
+            children[-1][key_parents - first_node, key_octants] = np.arange(
+                    nr_of_nodes, nr_of_nodes + len(keys))
+            parent_half_sizes = np.concatenate(half_sizes)[key_parents]
+            centers.append(np.concatenate(centers)[key_parents]
+                    + OCTANT_OFFSETS[key_octants]*parent_half_sizes[:,np.newaxis]/2)
+            half_sizes.append(parent_half_sizes/2)
+            children.append(np.full((len(keys),8), -1))
+            node[level_objects] = new_nodes
+            pair_objects.append(level_objects)
+            pair_nodes.append(new_nodes)
+            first_node, nr_of_nodes = nr_of_nodes, nr_of_nodes + len(keys)
+
+        self.center = np.concatenate(centers)
+        self.half_size = np.concatenate(half_sizes)
+        self.children = np.concatenate(children)
+        self.is_leaf = np.all(self.children < 0, axis=1)
+        self.nr_of_nodes = nr_of_nodes
+
+        # masses and centers of mass
+        pair_objects = np.concatenate(pair_objects)
+        pair_nodes = np.concatenate(pair_nodes)
+        pair_m = m_array[pair_objects]
+        self.mass = np.bincount(pair_nodes, pair_m, minlength=nr_of_nodes)
+        self.center_of_mass = np.copy(self.center)
+        has_mass = self.mass > 0
+        for d in range(3):
+            moment = np.bincount(pair_nodes, pair_m*r_array[pair_objects,d],
+                    minlength=nr_of_nodes)
+            self.center_of_mass[has_mass,d] = moment[has_mass]/self.mass[has_mass]
+
+        # objects sorted by leaf
+        self.order = np.argsort(node, kind='stable')
+        self.leaf_count = np.bincount(node, minlength=nr_of_nodes)
+        self.leaf_start = np.searchsorted(node[self.order], np.arange(nr_of_nodes))
+
+def _accumulate(out, index, values, length):
+    """Adds the rows of values to the rows index of out, repeated indices
+    are summed up."""
+    if values.ndim == 1:
+        out += np.bincount(index, values, minlength=length)
+        return
+    for d in range(values.shape[1]):
+        out[:,d] += np.bincount(index, values[:,d], minlength=length)
+
+def get_accelerations(r_array, m_array, opening_angle = 0.5, targets = None,
+        return_potentials = False, leaf_size = 16, chunk_size = 1024,
+        softening_length = 0):
+    """Returns the accelerations (N,3) of all objects, or only of the objects
+    with indices targets, using a Barnes-Hut octree over all objects. A node
+    of size s at distance d from a leaf is approximated by its center of mass
+    when s < opening_angle*d, so the cost is O(N log N). The tree is walked
+    once per leaf rather than once per object, and the resulting interactions
+    are then evaluated for every object in the leaf. With return_potentials
+    the gravitational potentials are returned as well. Leaves are processed
+    in chunks of chunk_size to bound the memory. All interactions use the
+    Plummer softening_length."""
+    tree = Octree(r_array, m_array, leaf_size)
+    N = len(r_array)
+    leaves = np.flatnonzero(tree.is_leaf & (tree.leaf_count > 0))
+    if targets is not None:
+        # only walk for the leaves of the targets
+        leaf_of_object = np.empty(N, dtype=int)
+        leaf_of_object[tree.order] = np.repeat(leaves, tree.leaf_count[leaves])
+        leaves = np.unique(leaf_of_object[targets])
+    a = np.zeros((N,3))
+    potentials = np.zeros(N)
+    for start in range(0, len(leaves), chunk_size):
+        _walk(tree, r_array, m_array, leaves[start:start+chunk_size],
+                opening_angle, a, potentials, softening_length)
+    if targets is not None:
+        a, potentials = a[targets], potentials[targets]
+    if return_potentials: return a, potentials
+    return a
+
+def _expand(tree, nodes):
+    """Returns the index of the pair and the object for every object in the
+    leaves nodes, for pairs given as an array of leaves."""
+    counts = tree.leaf_count[nodes]
+    pair = np.repeat(np.arange(len(nodes)), counts)
+    offsets = np.arange(len(pair)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return pair, tree.order[tree.leaf_start[nodes][pair] + offsets]
+
+def _walk(tree, r_array, m_array, leaves, opening_angle, a, potentials,
+        softening_length = 0):
+    """Walks the tree for the given leaves at once, one level per iteration,
+    and adds the accelerations and potentials of the objects in the leaves
+    to a and potentials."""
+    # (leaf, node) pairs still to be evaluated, starting at the root
+    g = leaves
+    n = np.zeros(len(leaves), dtype=int)
+    while len(g):
+        has_mass = tree.mass[n] > 0
+        g, n = g[has_mass], n[has_mass]
+        # distance from the center of mass of the node to the box of the leaf
+        gap = np.maximum(np.abs(tree.center_of_mass[n] - tree.center[g])
+                - tree.half_size[g][:,np.newaxis], 0)
+        distance_squared = np.einsum('ij,ij->i', gap, gap)
+        accept = (2*tree.half_size[n])**2 < opening_angle**2*distance_squared
+        # far nodes, monopole approximation for every object in the leaf
+        pair, i = _expand(tree, g[accept])
+        if len(i):
+            node = n[accept][pair]
+            R = tree.center_of_mass[node] - r_array[i]
+            distance = np.sqrt(np.einsum('ij,ij->i', R, R) + softening_length**2)
+            _accumulate(a, i, (G*tree.mass[node]/distance**3)[:,np.newaxis]*R, len(r_array))
+            _accumulate(potentials, i, -G*tree.mass[node]/distance, len(r_array))
+        # close leaves, direct sum between the objects of both leaves
+        direct = ~accept & tree.is_leaf[n]
+        pair, i = _expand(tree, g[direct])
+        if len(i):
+            node = n[direct][pair]
+            pair_j, j = _expand(tree, node)
+            i = i[pair_j]
+            not_self = (j != i) & (m_array[j] > 0)
+            i, j = i[not_self], j[not_self]
+            R = r_array[j] - r_array[i]
+            distance = np.sqrt(np.einsum('ij,ij->i', R, R) + softening_length**2)
+            _accumulate(a, i, (G*m_array[j]/distance**3)[:,np.newaxis]*R, len(r_array))
+            _accumulate(potentials, i, -G*m_array[j]/distance, len(r_array))
+        # close internal nodes, continue with their children
+        opened = ~accept & ~tree.is_leaf[n]
+        children = tree.children[n[opened]]
+        valid = children >= 0
+        g = np.repeat(g[opened], 8).reshape(-1,8)[valid]
+        n = children[valid]
+
+def get_accuracy_report(r_array, m_array, opening_angles = (0.2, 0.5, 0.8, 1.0),
+        nr_of_samples = 1000, leaf_size = 16):
+    """Compares Barnes-Hut accelerations to the direct sum for a random
+    sample of at most nr_of_samples objects. Returns one dict per opening
+    angle with the median, 99th percentile and maximum relative error and
+    the wall time of the Barnes-Hut evaluation of all objects."""
+    # the direct sum is imported here since simulation imports this module
+    from simulation import get_accelerations as get_direct_accelerations
+    N = len(r_array)
+    sample = np.random.default_rng(0).choice(N, min(nr_of_samples, N), replace=False)
+    a_direct = get_direct_accelerations(r_array, m_array, targets=sample)
+    a_norm = np.linalg.norm(a_direct, axis=1)
+    report = []
+    for opening_angle in opening_angles:
+        wall_time = time.perf_counter()
+        a = get_accelerations(r_array, m_array, opening_angle, leaf_size=leaf_size)
+        wall_time = time.perf_counter() - wall_time
+        errors = np.linalg.norm(a[sample] - a_direct, axis=1)/a_norm
+        report.append({
+            'opening_angle': opening_angle,
+            'median_error': float(np.median(errors)),
+            'percentile_99_error': float(np.percentile(errors, 99)),
+            'max_error': float(np.max(errors)),
+            'wall_time': wall_time
+        })
+    return report
@@ -0,0 +1,212 @@
+# Benchmarks of the integration methods, force backends and trajectory
+# storage on standard scenarios. Every case reports the steps per second,
+# the peak memory, the wall time and the relative energy drift per simulated
+# year. The results are written as JSON and can be compared to a baseline:
+#
+#   python benchmark.py --output baseline.json
+#   python benchmark.py --methods verlet yoshida-4 --baseline baseline.json
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+
+import jit_kernels
+from simulation import Simulation, get_accelerations, G, au, m_sun, day, year
+
+SCENARIOS = ['solar-system', 'asteroid', 'cluster-10', 'cluster-100', 'cluster-1000',
+        'cluster-10000']
+BACKENDS = ['direct', 'barnes-hut']
+STORAGES = ['memory', 'file', 'directory']
+
+def add_cluster(simulation, N, radius = 100*au, seed = 0):
+    """Adds N objects of one solar mass, uniformly distributed in a sphere of
+    radius and with velocities close to virial equilibrium. time_step is
+    set to 1/1000 of the crossing time and softening_length to radius/100."""
+    rng = np.random.default_rng(seed)
+    directions = rng.normal(size=(N,3))
+    directions /= np.linalg.norm(directions, axis=1)[:,np.newaxis]
+    r = radius*rng.uniform(size=(N,1))**(1/3)*directions
+    # <v^2> = 3/5 G M/R for a uniform sphere in virial equilibrium
+    v = np.sqrt(G*N*m_sun/radius/5)*rng.normal(size=(N,3))
+    r -= np.mean(r, axis=0)
+    v -= np.mean(v, axis=0)
+    simulation.add_objects(['Star %d' % i for i in range(N)], m_sun, r, v, c=[0.9,0.9,0])
+    simulation.time_step = 1e-3*radius/np.sqrt(3/5*G*N*m_sun/radius)
+    simulation.softening_length = radius/100
+
+def create_simulation(scenario, method, scale = 1):
+    """Returns the simulation of scenario and the number of steps to take,
+    which is multiplied by scale."""
+    simulation = Simulation(method)
+    if scenario in ('solar-system', 'asteroid'):
+        simulation.add_solar_system()
+        if scenario == 'asteroid':
+            import main
+            main.add_asteriod(simulation)
+        simulation.time_step = day
+        nr_of_steps = 2000
+    elif scenario.startswith('cluster-'):
+        N = int(scenario[len('cluster-'):])
+        add_cluster(simulation, N)
+        nr_of_steps = max(10000//N, 4)
+    else:
+        raise ValueError('Unknown scenario: %s' % scenario)
+    return simulation, max(int(nr_of_steps*scale), 2)
+
+def get_total_energy(simulation, block_size = 1000):
+    """Returns the total energy of simulation, with the potential energy
+    summed over blocks of rows, so large systems fit into memory."""
+    r, v, m = simulation.r_array, simulation.v_array, simulation.m_array
+    N = simulation.nr_of_massive_objects
+    potential_energy = 0
+    for start in range(0, len(r), block_size):
+        targets = np.arange(start, min(start + block_size, len(r)))
+        _, distances = get_accelerations(r, m, return_distances=True, targets=targets,
+                nr_of_sources=N, softening_length=simulation.softening_length)
+        potential_energy += -G/2*np.sum(m[targets,np.newaxis]*m[:N]/distances)
+    return potential_energy + 1/2*np.sum(m*np.einsum('ij,ij->i', v, v))
+
+def _execute(scenario, method, backend, storage, nr_of_steps, n_threads, directory,
+        trace_memory = False):
+    """Executes nr_of_steps steps of a new simulation of the case and returns
+    it, with the energies before and after and the wall time. With
+    trace_memory, the peak memory of execute_simulation() is returned
+    instead of the wall time."""
+    simulation, _ = create_simulation(scenario, method)
+    simulation.force_backend = backend
+    simulation.n_threads = n_threads
+    if storage == 'file':
+        simulation.trajectory_file = os.path.join(directory, 'trajectory.npy')
+    elif storage == 'directory':
+        simulation.trajectory_directory = os.path.join(directory, 'trajectory')
+    simulation.t_end = (nr_of_steps - 0.5)*simulation.time_step
+    energy_before = get_total_energy(simulation)
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            simulation.execute_simulation()
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return simulation, energy_before, get_total_energy(simulation), peak_memory
+    start = time.perf_counter()
+    simulation.execute_simulation()
+    wall_time = time.perf_counter() - start
+    return simulation, energy_before, get_total_energy(simulation), wall_time
+
+def run_case(scenario, method, backend = 'direct', storage = 'memory', scale = 1,
+        n_threads = 1):
+    """Benchmarks one case and returns its results as a dict. A short run
+    first compiles the kernels, then one run measures the peak memory of
+    the NumPy allocations with tracemalloc and another one the time."""
+    _, nr_of_steps = create_simulation(scenario, method, scale)
+    result = {'scenario': scenario, 'method': method, 'backend': backend,
+            'storage': storage, 'n_threads': n_threads, 'steps': nr_of_steps}
+    with tempfile.TemporaryDirectory() as directory:
+        args = (scenario, method, backend, storage)
+        _execute(*args, 2, n_threads, directory)
+        _, _, _, peak_memory = _execute(*args, nr_of_steps, n_threads, directory, True)
+        simulation, energy_before, energy_after, wall_time = _execute(*args,
+                nr_of_steps, n_threads, directory)
+    years = simulation.t/year
+    result.update({
+        'objects': simulation.nr_of_objects,
+        'jit': simulation._use_jit_kernels(),
+        'wall_time': wall_time,
+        'steps_per_second': nr_of_steps/wall_time,
+        'peak_memory': peak_memory,
+        'energy_drift_per_year': abs((energy_after - energy_before)/energy_before)/years,
+        'wall_time_per_year': wall_time/years
+    })
+    return result
+
+def _get_key(result):
+    return (result['scenario'], result['method'], result['backend'], result['storage'],
+            result['n_threads'])
+
+def compare(results, baseline, threshold = 0.1):
+    """Returns the cases of results that are more than threshold slower, in
+    steps per second, than the same cases of baseline, as a list of
+    (result, baseline result)."""
+    baseline = {_get_key(result): result for result in baseline if 'error' not in result}
+    regressions = []
+    for result in results:
+        base = baseline.get(_get_key(result))
+        if base is None or 'error' in result: continue
+        if result['steps_per_second'] < (1 - threshold)*base['steps_per_second']:
+            regressions.append((result, base))
+    return regressions
+
+def get_metadata():
+    """Returns the machine and library versions the benchmark ran with."""
+    return {
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'numba': jit_kernels.numba.__version__ if jit_kernels.AVAILABLE else None,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count()
+    }
+
+def main(argv = None):
+    methods = list(Simulation().methods_dict)
+    parser = argparse.ArgumentParser(description='Benchmarks the simulation on standard scenarios.')
+    parser.add_argument('--scenarios', nargs='+', default=SCENARIOS,
+            help='solar-system, asteroid or cluster-N, default: %(default)s')
+    parser.add_argument('--methods', nargs='+', default=methods, choices=methods)
+    parser.add_argument('--backends', nargs='+', default=['direct'], choices=BACKENDS)
+    parser.add_argument('--storages', nargs='+', default=['memory'], choices=STORAGES)
+    parser.add_argument('--scale', type=float, default=1,
+            help='factor on the number of steps of every scenario')
+    parser.add_argument('--threads', type=int, default=1, help='n_threads of the simulations')
+    parser.add_argument('--output', help='JSON file to write the results to')
+    parser.add_argument('--baseline', help='JSON file of earlier results to compare to')
+    parser.add_argument('--threshold', type=float, default=0.1,
+            help='relative slowdown reported as a regression, default: %(default)s')
+    args = parser.parse_args(argv)
+
+    print('%-14s %-15s %-10s %-9s %12s %10s %12s %12s' % ('scenario', 'method', 'backend',
+            'storage', 'steps/s', 'memory/MB', 'drift/year', 'wall s/year'))
+    results = []
+    for scenario in args.scenarios:
+        for method in args.methods:
+            for backend in args.backends:
+                for storage in args.storages:
+                    try:
+                        result = run_case(scenario, method, backend, storage, args.scale,
+                                args.threads)
+                        print('%-14s %-15s %-10s %-9s %12.1f %10.1f %12.3g %12.3g' % (
+                                scenario, method, backend, storage,
+                                result['steps_per_second'], result['peak_memory']/2**20,
+                                result['energy_drift_per_year'], result['wall_time_per_year']))
+                    except Exception as error:
+                        result = {'scenario': scenario, 'method': method, 'backend': backend,
+                                'storage': storage, 'n_threads': args.threads,
+                                'error': '%s: %s' % (type(error).__name__, error)}
+                        print('%-14s %-15s %-10s %-9s %s' % (scenario, method, backend,
+                                storage, result['error']))
+                    results.append(result)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'metadata': get_metadata(), 'results': results}, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for result, base in regressions:
+            print('Regression: %s %s %s %s, %.1f steps/s, baseline %.1f' % (
+                    result['scenario'], result['method'], result['backend'],
+                    result['storage'], result['steps_per_second'], base['steps_per_second']))
+        if regressions: return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+import csv
+import hashlib
+import os
+import numpy as np
+from simulation import G, m_sun
+
+# Columns of a catalog, every row needs either the state vector or the
+# orbital elements. SI units, angles in degrees
+STATE_COLUMNS = ['x', 'y', 'z', 'vx', 'vy', 'vz']
+ELEMENT_COLUMNS = ['a', 'e', 'i', 'Omega', 'omega', 'M']
+
+def get_state_vectors(a, e, i, Omega, omega, M, mu):
+    """Returns the positions (K,3) and velocities (K,3) relative to the
+    central body of elliptic orbits with semi-major axes a, eccentricities
+    e, inclinations i, longitudes of the ascending node Omega, arguments of
+    periapsis omega and mean anomalies M, in radians, and gravitational
+    parameters mu = G*(m_central + m)."""
+    if np.any((e < 0) | (e >= 1)):
+        raise ValueError('Only elliptic orbits, 0 <= e < 1, are supported')
+    # Kepler's equation M = E - e*sin(E), by Newton's method
+    E = np.where(e < 0.8, M, np.pi)
+    for _ in range(50):
+        dE = (E - e*np.sin(E) - M)/(1 - e*np.cos(E))
+        E -= dE
+        if np.all(np.abs(dE) < 1e-14): break
+    cos_E, sin_E = np.cos(E), np.sin(E)
+    b = np.sqrt(1 - e**2)
+    distance = a*(1 - e*cos_E)
+    # positions and velocities in the orbital plane, along P and Q
+    x, y = a*(cos_E - e), a*b*sin_E
+    vx, vy = -np.sqrt(mu*a)/distance*sin_E, np.sqrt(mu*a)/distance*b*cos_E
+    cos_O, sin_O = np.cos(Omega), np.sin(Omega)
+    cos_w, sin_w = np.cos(omega), np.sin(omega)
+    cos_i, sin_i = np.cos(i), np.sin(i)
+    P = np.column_stack([cos_O*cos_w - sin_O*sin_w*cos_i, sin_O*cos_w + cos_O*sin_w*cos_i,
+            sin_w*sin_i])
+    Q = np.column_stack([-cos_O*sin_w - sin_O*cos_w*cos_i, -sin_O*sin_w + cos_O*cos_w*cos_i,
+            cos_w*sin_i])
+    r = x[:,np.newaxis]*P + y[:,np.newaxis]*Q
+    v = vx[:,np.newaxis]*P + vy[:,np.newaxis]*Q
+    return r, v
+
+def _parse_catalog(path, central_mass):
+    """Returns the names and the (K,7) array of masses, positions and
+    velocities of the CSV catalog path, see read_catalog(...)."""
+    with open(path, newline='') as file:
+        rows = list(csv.reader(file))
+    header = [name.strip() for name in rows[0]]
+    columns = dict(zip(header, zip(*rows[1:])))
+    K = len(rows) - 1
+    def column(name):
+        if name not in columns: return np.full(K, np.nan)
+        values = np.char.strip(np.array(columns[name], dtype=str))
+        return np.where(values == '', 'nan', values).astype(float)
+    names = np.array(columns['name'], dtype=str) if 'name' in columns else (
+            np.arange(1, K + 1).astype(str))
+    m = np.nan_to_num(column('m'))
+    state = np.column_stack([column(name) for name in STATE_COLUMNS]).reshape(K,6)
+    # rows without a state vector are given by their orbital elements
+    from_elements = np.isnan(state).any(axis=1)
+    if np.any(from_elements):
+        elements = [column(name)[from_elements] for name in ELEMENT_COLUMNS]
+        if np.any(np.isnan(elements)):
+            raise ValueError('Every row of %s needs a state vector or orbital elements' % path)
+        a, e = elements[:2]
+        angles = [np.radians(x) for x in elements[2:]]
+        r, v = get_state_vectors(a, e, *angles, G*(central_mass + m[from_elements]))
+        state[from_elements] = np.column_stack([r, v])
+    return names, np.column_stack([m, state])
+
+def _get_cache_key(path, central_mass):
+    """Returns the hash of the contents of path and central_mass."""
+    digest = hashlib.sha1(repr(float(central_mass)).encode())
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(2**20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def read_catalog(path, central_mass = m_sun, cache_directory = None):
+    """Returns the names (K,), masses (K,), positions (K,3) and velocities
+    (K,3) of the bodies of the CSV catalog path. Its header names the
+    columns: 'name', 'm', the state vector 'x', 'y', 'z', 'vx', 'vy', 'vz'
+    and the orbital elements 'a', 'e', 'i', 'Omega', 'omega', 'M', in SI
+    units and degrees. Rows without a state vector are converted from their
+    elements, relative to a central body of central_mass. The parsed
+    catalog is cached as .npy files in cache_directory, by default
+    .catalog_cache next to path, under the hash of the catalog, so later
+    calls only memory map the cache."""
+    if cache_directory is None:
+        cache_directory = os.path.join(os.path.dirname(str(path)), '.catalog_cache')
+    key = _get_cache_key(path, central_mass)
+    data_path = os.path.join(cache_directory, key + '.npy')
+    names_path = os.path.join(cache_directory, key + '_names.npy')
+    if not (os.path.exists(data_path) and os.path.exists(names_path)):
+        names, data = _parse_catalog(path, central_mass)
+        os.makedirs(cache_directory, exist_ok=True)
+        # written to temporary files and swapped in, so that a cache file
+        # that exists is complete
+        for cache_path, array in ((names_path, names), (data_path, data)):
+            with open(cache_path + '.tmp', 'wb') as file:
+                np.save(file, array)
+            os.replace(cache_path + '.tmp', cache_path)
+    names = np.load(names_path, mmap_mode='r')
+    data = np.load(data_path, mmap_mode='r')
+    return names, data[:,0], data[:,1:4], data[:,4:7]
+
+def add_catalog(simulation, path, center = None, c = 'k', A = None, test_particle = False,
+        central_mass = None, cache_directory = None):
+    """Adds the bodies of the catalog path, see read_catalog(...), to
+    simulation in one add_objects(...) call. The positions and velocities
+    are relative to the object named center, if given, e.g. 'Sun' for
+    heliocentric catalogs. Without central_mass, the orbital elements are
+    relative to the mass of center, or m_sun without center."""
+    if center is not None:
+        index = simulation.name_array.index(center)
+        if central_mass is None: central_mass = simulation.m_array[index]
+    elif central_mass is None:
+        central_mass = m_sun
+    names, m, r, v = read_catalog(path, central_mass, cache_directory)
+    if center is not None:
+        r = r + simulation.r_array[index]
+        v = v + simulation.v_array[index]
+    simulation.add_objects(names.tolist(), m, r, v, c, A, test_particle)
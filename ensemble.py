@@ -0,0 +1,139 @@
+import numpy as np
+from simulation import Simulation
+
+# Methods whose steps only use whole-state array operations, so that they
+# advance all members of an ensemble at once
+ENSEMBLE_METHODS = ['euler', 'euler-cromer', 'verlet', 'runge-kutta',
+        'dormand-prince', 'yoshida-4', 'yoshida-6', 'forest-ruth']
+
+# Settings that an ensemble shares with the simulation it is made from and
+# with its members, see get_member(...)
+MEMBER_SETTINGS = ['time_step', 't', 't_end', 'record_every', 'track_energy', 'dense_output',
+        'tolerance', 'softening_length', 'nr_of_objects', 'nr_of_massive_objects']
+
+class Ensemble(Simulation):
+    """M variations of one simulation that are integrated together. The state
+    is stored as (M,N,3) positions and velocities and (M,N) masses, so every
+    step advances all members with one vectorized force evaluation.
+
+    The members share the objects, method, time step and recording settings
+    of simulation. m (M,N), r (M,N,3) and v (M,N,3) give the masses, initial
+    positions and velocities of every member, those that are None are copied
+    from simulation. After execute_simulation(), get_member(k) returns the
+    result of member k as a Simulation. Events, encounter_radius,
+    trajectory_directory, checkpoints and n_threads are not supported."""
+
+    def __init__(self, simulation, m = None, r = None, v = None):
+        if simulation.method not in ENSEMBLE_METHODS:
+            raise ValueError('Method %s can not be used for an ensemble' % simulation.method)
+        if simulation.force_backend != 'direct':
+            raise ValueError('Ensembles are evaluated with the direct force backend')
+        Simulation.__init__(self, simulation.method, simulation.adaptive_time_step)
+        for key in MEMBER_SETTINGS:
+            setattr(self, key, getattr(simulation, key))
+        self.name_array = list(simulation.name_array)
+        self.color_data = list(simulation.color_data)
+        self.area_data = list(simulation.area_data)
+
+        nr_of_members = [len(x) for x in (m, r, v) if x is not None]
+        if not nr_of_members:
+            raise ValueError('At least one of m, r and v must be given')
+        M = nr_of_members[0]
+        N = self.nr_of_objects
+        def members(x, base, shape):
+            if x is None: x = base
+            return np.array(np.broadcast_to(np.asarray(x, dtype=float), (M,) + shape))
+        self._m_buffer = members(m, simulation.m_array, (N,))
+        self._r_buffer = members(r, simulation.r_array, (N,3))
+        self._v_buffer = members(v, simulation.v_array, (N,3))
+        # test particles stay massless
+        self._m_buffer[:,self.nr_of_massive_objects:] = 0
+        self.nr_of_members = M
+
+    @property
+    def m_array(self):
+        """Masses of the objects of all members, (M,N) array."""
+        return self._m_buffer
+
+    @m_array.setter
+    def m_array(self, m):
+        self._m_buffer[:] = m
+
+    @property
+    def r_array(self):
+        """Positions of the objects of all members, (M,N,3) array."""
+        return self._r_buffer
+
+    @r_array.setter
+    def r_array(self, r):
+        self._r_buffer[:] = r
+
+    @property
+    def v_array(self):
+        """Velocities of the objects of all members, (M,N,3) array."""
+        return self._v_buffer
+
+    @v_array.setter
+    def v_array(self, v):
+        self._v_buffer[:] = v
+
+    def add_objects(self, *args, **kwargs):
+        raise ValueError('Objects can not be added to an ensemble, add them to the simulation')
+
+    def add_event(self, *args, **kwargs):
+        raise ValueError('Events are not supported for ensembles')
+
+    def save_checkpoint(self, path):
+        raise ValueError('Checkpoints are not supported for ensembles')
+
+    @classmethod
+    def load_checkpoint(cls, path):
+        raise ValueError('Checkpoints are not supported for ensembles')
+
+    def _check_settings(self):
+        """Raises a ValueError for settings that assume the objects on the
+        first axis of the state, which holds the members in an ensemble."""
+        if self.method not in ENSEMBLE_METHODS:
+            raise ValueError('Method %s can not be used for an ensemble' % self.method)
+        if self.force_backend != 'direct':
+            raise ValueError('Ensembles are evaluated with the direct force backend')
+        for key in ['events', 'encounter_radius', 'trajectory_directory', 'checkpoint_file']:
+            if getattr(self, key):
+                raise ValueError('%s is not supported for ensembles' % key)
+        if self.n_threads > 1:
+            raise ValueError('n_threads is not supported for ensembles')
+
+    def execute_simulation(self):
+        self._check_settings()
+        Simulation.execute_simulation(self)
+
+    def iter_steps(self, batch = 1):
+        self._check_settings()
+        return Simulation.iter_steps(self, batch)
+
+    def get_member(self, k):
+        """Returns member k as a Simulation, with its current state, stored
+        trajectory and energies."""
+        member = Simulation(self.method, self.adaptive_time_step)
+        for key in MEMBER_SETTINGS:
+            setattr(member, key, getattr(self, key))
+        member.name_array = list(self.name_array)
+        member.color_data = list(self.color_data)
+        member.area_data = list(self.area_data)
+        member._m_buffer = np.copy(self.m_array[k])
+        member._r_buffer = np.copy(self.r_array[k])
+        member._v_buffer = np.copy(self.v_array[k])
+        if self.nr_of_samples:
+            member.nr_of_samples = self.nr_of_samples
+            member._r_data = np.array(self._r_data[:self.nr_of_samples,k])
+            member._t_data = np.array(self._t_data[:self.nr_of_samples])
+            if self._v_data is not None:
+                member._v_data = np.array(self._v_data[:self.nr_of_samples,k])
+        member.potential_energy_data = [E[k] for E in self.potential_energy_data]
+        member.kinetic_energy_data = [E[k] for E in self.kinetic_energy_data]
+        member.total_energy_data = [E[k] for E in self.total_energy_data]
+        return member
+
+    def get_members(self):
+        """Returns all members as a list of Simulations, see get_member(...)."""
+        return [self.get_member(k) for k in range(self.nr_of_members)]
@@ -0,0 +1,305 @@
+import numpy as np
+try:
+    import numba
+except ImportError:
+    numba = None
+
+G = 6.674e-11           # 6.674*10^(−11) N*(m/kg)^2
+
+# numba is optional, without it the kernels below are plain Python functions
+# and Simulation uses the NumPy steppers instead. The kernels release the GIL,
+# so they can run in parallel threads
+AVAILABLE = numba is not None
+if AVAILABLE:
+    njit = numba.njit(cache=True, nogil=True)
+else:
+    njit = lambda function: function
+
+# Methods with a compiled kernel, and their ids in the kernels
+(EULER, EULER_CROMER, VERLET, RUNGE_KUTTA, DORMAND_PRINCE, KICK_DRIFT_KICK,
+        DRIFT_KICK_DRIFT, WISDOM_HOLMAN) = range(8)
+METHOD_IDS = {
+    'euler': EULER,
+    'euler-cromer': EULER_CROMER,
+    'verlet': VERLET,
+    'runge-kutta': RUNGE_KUTTA,
+    'dormand-prince': DORMAND_PRINCE,
+    'yoshida-4': KICK_DRIFT_KICK,
+    'yoshida-6': KICK_DRIFT_KICK,
+    'forest-ruth': DRIFT_KICK_DRIFT,
+    'wisdom-holman': WISDOM_HOLMAN
+}
+
+@njit
+def get_accelerations(r, m, nr_of_sources, softening_length, a):
+    """Writes the accelerations at positions r (N,3) into a (N,3), with
+    Plummer softening_length. Only the first nr_of_sources objects exert
+    forces, every pair of them is evaluated once."""
+    N = r.shape[0]
+    a[:] = 0
+    for i in range(nr_of_sources):
+        for j in range(i + 1, nr_of_sources):
+            dx = r[j,0] - r[i,0]
+            dy = r[j,1] - r[i,1]
+            dz = r[j,2] - r[i,2]
+            distance_squared = dx*dx + dy*dy + dz*dz + softening_length**2
+            k = G/(distance_squared*np.sqrt(distance_squared))
+            a[i,0] += k*m[j]*dx
+            a[i,1] += k*m[j]*dy
+            a[i,2] += k*m[j]*dz
+            a[j,0] -= k*m[i]*dx
+            a[j,1] -= k*m[i]*dy
+            a[j,2] -= k*m[i]*dz
+    for i in range(nr_of_sources, N):
+        for j in range(nr_of_sources):
+            dx = r[j,0] - r[i,0]
+            dy = r[j,1] - r[i,1]
+            dz = r[j,2] - r[i,2]
+            distance_squared = dx*dx + dy*dy + dz*dz + softening_length**2
+            k = G*m[j]/(distance_squared*np.sqrt(distance_squared))
+            a[i,0] += k*dx
+            a[i,1] += k*dy
+            a[i,2] += k*dz
+
+@njit
+def get_row_accelerations(r, m, nr_of_sources, softening_length, start, stop, a,
+        potentials):
+    """Writes the accelerations and gravitational potentials of the objects
+    start to stop, due to the first nr_of_sources objects, into those rows of
+    a (N,3) and potentials (N,). Blocks of rows are independent, so they can
+    be evaluated by different threads."""
+    for i in range(start, stop):
+        a_x, a_y, a_z, potential = 0.0, 0.0, 0.0, 0.0
+        for j in range(nr_of_sources):
+            if j == i: continue
+            dx = r[j,0] - r[i,0]
+            dy = r[j,1] - r[i,1]
+            dz = r[j,2] - r[i,2]
+            distance = np.sqrt(dx*dx + dy*dy + dz*dz + softening_length**2)
+            k = G*m[j]/distance**3
+            a_x += k*dx
+            a_y += k*dy
+            a_z += k*dz
+            potential -= G*m[j]/distance
+        a[i,0], a[i,1], a[i,2] = a_x, a_y, a_z
+        potentials[i] = potential
+
+@njit
+def get_energies(r, v, m, nr_of_sources, softening_length):
+    """Returns the potential and kinetic energy of the system."""
+    potential_energy = 0.0
+    for i in range(nr_of_sources):
+        for j in range(i + 1, nr_of_sources):
+            dx = r[j,0] - r[i,0]
+            dy = r[j,1] - r[i,1]
+            dz = r[j,2] - r[i,2]
+            potential_energy -= G*m[i]*m[j]/np.sqrt(dx*dx + dy*dy + dz*dz
+                    + softening_length**2)
+    kinetic_energy = 0.0
+    for i in range(r.shape[0]):
+        kinetic_energy += m[i]*(v[i,0]**2 + v[i,1]**2 + v[i,2]**2)/2
+    return potential_energy, kinetic_energy
+
+@njit
+def _get_stumpff_functions(z):
+    """Returns the Stumpff functions C(z) and S(z), using their series for
+    |z| < 0.1 to avoid cancellation."""
+    if abs(z) < 0.1:
+        C, S = 1/2, 1/6
+        term_C, term_S = 1/2, 1/6
+        for k in range(7):
+            term_C = term_C*(-z)/((2*k + 3)*(2*k + 4))
+            term_S = term_S*(-z)/((2*k + 4)*(2*k + 5))
+            C += term_C
+            S += term_S
+        return C, S
+    s = np.sqrt(abs(z))
+    if z > 0:
+        return 2*np.sin(s/2)**2/z, (s - np.sin(s))/s**3
+    return 2*np.sinh(s/2)**2/(-z), (np.sinh(s) - s)/s**3
+
+@njit
+def kepler_drift(r, v, mu, dt):
+    """Advances the positions r (N,3) and velocities v (N,3) relative to a
+    central mass with mu = G*M by dt along their Keplerian orbits, in place,
+    see simulation.kepler_drift(...)."""
+    sqrt_mu = np.sqrt(mu)
+    for i in range(r.shape[0]):
+        r_0 = np.sqrt(r[i,0]**2 + r[i,1]**2 + r[i,2]**2)
+        v_r0 = (r[i,0]*v[i,0] + r[i,1]*v[i,1] + r[i,2]*v[i,2])/r_0
+        alpha = 2/r_0 - (v[i,0]**2 + v[i,1]**2 + v[i,2]**2)/mu
+        chi = sqrt_mu*dt/r_0
+        for _ in range(50):
+            z = alpha*chi**2
+            C, S = _get_stumpff_functions(z)
+            F = (r_0*v_r0/sqrt_mu*chi**2*C + (1 - alpha*r_0)*chi**3*S
+                    + r_0*chi - sqrt_mu*dt)
+            dF = (r_0*v_r0/sqrt_mu*chi*(1 - z*S) + (1 - alpha*r_0)*chi**2*C
+                    + r_0)
+            delta = F/dF
+            chi -= delta
+            if abs(delta) <= 1e-15*abs(chi): break
+        C, S = _get_stumpff_functions(alpha*chi**2)
+        # Lagrange coefficients
+        f = 1 - chi**2/r_0*C
+        g = dt - chi**3/sqrt_mu*S
+        x, y, z = f*r[i,0] + g*v[i,0], f*r[i,1] + g*v[i,1], f*r[i,2] + g*v[i,2]
+        r_norm = np.sqrt(x*x + y*y + z*z)
+        f_dot = sqrt_mu/(r_norm*r_0)*(alpha*chi**3*S - chi)
+        g_dot = 1 - chi**2/r_norm*C
+        for d in range(3):
+            v[i,d] = f_dot*r[i,d] + g_dot*v[i,d]
+        r[i,0], r[i,1], r[i,2] = x, y, z
+
+@njit
+def _weighted_sum(m, x):
+    """Returns m@x for masses m (N,) and vectors x (N,3)."""
+    total = np.zeros(3)
+    for i in range(x.shape[0]):
+        for d in range(3):
+            total[d] += m[i]*x[i,d]
+    return total
+
+@njit
+def _wisdom_holman_step(r, v, m, nr_of_sources, softening_length, dt, work):
+    """Wisdom-Holman step in democratic heliocentric coordinates, see
+    Simulation.wisdom_holman_step()."""
+    N = r.shape[0]
+    i_0 = np.argmax(m)
+    m_0, M = m[i_0], np.sum(m)
+    r_cm, v_cm = _weighted_sum(m, r)/M, _weighted_sum(m, v)/M
+    # heliocentric positions and barycentric velocities
+    Q, P, a = work[0][:N-1], work[1][:N-1], work[2][:N-1]
+    m_others = np.empty(N - 1)
+    k = 0
+    for i in range(N):
+        if i != i_0:
+            m_others[k] = m[i]
+            Q[k] = r[i] - r[i_0]
+            P[k] = v[i] - v_cm
+            k += 1
+    get_accelerations(Q, m_others, nr_of_sources - 1, softening_length, a)
+    P += 1/2*a*dt
+    Q += 1/2*_weighted_sum(m_others, P)/m_0*dt
+    kepler_drift(Q, P, G*m_0, dt)
+    Q += 1/2*_weighted_sum(m_others, P)/m_0*dt
+    get_accelerations(Q, m_others, nr_of_sources - 1, softening_length, a)
+    P += 1/2*a*dt
+    # back to positions and velocities relative to the origin
+    r_0 = r_cm + v_cm*dt - _weighted_sum(m_others, Q)/M
+    v_0 = v_cm - _weighted_sum(m_others, P)/m_0
+    k = 0
+    for i in range(N):
+        if i == i_0:
+            r[i], v[i] = r_0, v_0
+        else:
+            r[i] = Q[k] + r_0
+            v[i] = P[k] + v_cm
+            k += 1
+
+@njit
+def _step(method, coefficients, r, v, m, nr_of_sources, softening_length, dt, a, work):
+    """Advances r and v by one step of dt in place. a holds the accelerations
+    at r on entry and on exit, except for DRIFT_KICK_DRIFT and WISDOM_HOLMAN
+    which do not use it. coefficients holds the Butcher tableau of
+    DORMAND_PRINCE, or the substep weights of the composition methods in
+    its first row. work is a (16,N,3) scratch array."""
+    if method == EULER:
+        r += v*dt
+        v += a*dt
+        get_accelerations(r, m, nr_of_sources, softening_length, a)
+    elif method == EULER_CROMER:
+        v += a*dt
+        r += v*dt
+        get_accelerations(r, m, nr_of_sources, softening_length, a)
+    elif method == VERLET:
+        r += v*dt + 1/2*a*dt**2
+        a_2 = work[0]
+        get_accelerations(r, m, nr_of_sources, softening_length, a_2)
+        v += 1/2*(a + a_2)*dt
+        a[:] = a_2
+    elif method == RUNGE_KUTTA:
+        a_1, a_2, a_3, a_4 = work[0], work[1], work[2], work[3]
+        b_1, b_2, b_3, b_4 = work[4], work[5], work[6], work[7]
+        r_i = work[8]
+        a_1[:] = a*dt
+        b_1[:] = v*dt
+        r_i[:] = r + b_1/2
+        get_accelerations(r_i, m, nr_of_sources, softening_length, a_2)
+        a_2 *= dt
+        b_2[:] = (v + a_1/2)*dt
+        r_i[:] = r + b_2/2
+        get_accelerations(r_i, m, nr_of_sources, softening_length, a_3)
+        a_3 *= dt
+        b_3[:] = (v + a_2/2)*dt
+        r_i[:] = r + b_3
+        get_accelerations(r_i, m, nr_of_sources, softening_length, a_4)
+        a_4 *= dt
+        b_4[:] = (v + a_3)*dt
+        v += (a_1 + 2*a_2 + 2*a_3 + a_4)/6
+        r += (b_1 + 2*b_2 + 2*b_3 + b_4)/6
+        get_accelerations(r, m, nr_of_sources, softening_length, a)
+    elif method == DORMAND_PRINCE:
+        # stage velocities k_r and accelerations k_v, the last stage is
+        # evaluated at the new state
+        k_r, k_v = work[0:7], work[7:14]
+        r_i, v_i = work[14], work[15]
+        k_r[0] = v
+        k_v[0] = a
+        for i in range(1, 7):
+            r_i[:] = r
+            v_i[:] = v
+            for j in range(i):
+                r_i += dt*coefficients[i,j]*k_r[j]
+                v_i += dt*coefficients[i,j]*k_v[j]
+            k_r[i] = v_i
+            get_accelerations(r_i, m, nr_of_sources, softening_length, k_v[i])
+        r[:] = r_i
+        v[:] = v_i
+        a[:] = k_v[6]
+    elif method == KICK_DRIFT_KICK:
+        for w in coefficients[0]:
+            v += 1/2*a*w*dt
+            r += v*w*dt
+            get_accelerations(r, m, nr_of_sources, softening_length, a)
+            v += 1/2*a*w*dt
+    elif method == DRIFT_KICK_DRIFT:
+        for w in coefficients[0]:
+            r += 1/2*v*w*dt
+            get_accelerations(r, m, nr_of_sources, softening_length, a)
+            v += a*w*dt
+            r += 1/2*v*w*dt
+    elif method == WISDOM_HOLMAN:
+        _wisdom_holman_step(r, v, m, nr_of_sources, softening_length, dt, work)
+
+@njit
+def run(method, coefficients, r, v, m, nr_of_sources, softening_length, t, t_end, dt,
+        step, stop_step, record_every, track_energy, t_data, r_data, v_data, energy_data,
+        nr_of_samples):
+    """Integrates r and v in place from t until t_end, until the sample
+    buffers are full or until step reaches stop_step, with the same steps
+    and samples as Simulation.execute_simulation(). Every record_every-th
+    step and the last step are written to t_data, r_data, to v_data unless
+    it is empty and, with track_energy, to energy_data (potential, kinetic,
+    total). Returns t, the number of steps taken since the start of the
+    simulation and the number of samples."""
+    a = np.empty_like(r)
+    work = np.empty((16,) + r.shape)
+    get_accelerations(r, m, nr_of_sources, softening_length, a)
+    while t < t_end and nr_of_samples < len(t_data) and step < stop_step:
+        _step(method, coefficients, r, v, m, nr_of_sources, softening_length, dt, a, work)
+        t += dt
+        step += 1
+        if step % record_every == 0 or t >= t_end:
+            t_data[nr_of_samples] = t
+            r_data[nr_of_samples] = r
+            if len(v_data):
+                v_data[nr_of_samples] = v
+            if track_energy:
+                potential_energy, kinetic_energy = get_energies(r, v, m, nr_of_sources,
+                        softening_length)
+                energy_data[nr_of_samples,0] = potential_energy
+                energy_data[nr_of_samples,1] = kinetic_energy
+                energy_data[nr_of_samples,2] = potential_energy + kinetic_energy
+            nr_of_samples += 1
+    return t, step, nr_of_samples
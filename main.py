@@ -16,12 +16,8 @@
 
 
 # ---------------------- Import libraries
-# To save animation
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
-from matplotlib.pylab import *
-# from mpl_toolkits.mplot3d import Axes3D
-import mpl_toolkits.mplot3d.axes3d as p3
+# matplotlib is imported by the plotting functions, so that the initial
+# conditions below can be imported without it, e.g. by worker processes
 import numpy as np
 # import math as m
 import datetime
@@ -29,12 +25,10 @@ date = str(datetime.datetime.now()).replace(':','.')[2:19]
 dated_filename = 'assets/archive/'+date
 
 from simulation import Simulation
+from sweep import run_sweep
+from trajectory import Trajectory
 import math_functions as mf
 
-matplotlib.rcParams['mathtext.fontset'] = 'stix'
-matplotlib.rcParams['font.family'] = 'STIXGeneral'
-matplotlib.rcParams['font.size'] = 12
-
 
 # ---------------------- Define variables
 
@@ -125,6 +119,22 @@ def add_asteriod(simulation, m=9.393e20, vz=0):
         A = 473000**2*np.pi
     )
 
+def add_asteriod_swarm(simulation, vz_array):
+    """Adds one massless asteriod per vertical velocity in vz_array, with the
+    same initial conditions as add_asteriod(...) otherwise. The asteriods are
+    test particles, so they do not disturb the planets or each other.
+    """
+    vz_array = np.asarray(vz_array, dtype=float)
+    simulation.add_objects(
+        names = ['Asteriod %g' % vz for vz in vz_array],
+        m = 0,
+        r = np.tile([414010000*1000,0,0], (len(vz_array),1)),
+        v = np.column_stack([np.full(len(vz_array),-5000), np.full(len(vz_array),5000), vz_array]),
+        c = [50/256,60/256,60/256],
+        A = 473000**2*np.pi,
+        test_particle = True
+    )
+
 def add_asteriod_and_sun(simulation,m=9.393e20):
     simulation.add_object(
         name = 'Sun',
@@ -146,11 +156,27 @@ def add_asteriod_and_sun(simulation,m=9.393e20):
 
 # ---------------------- Main calculation
 
-def get_initial_positions_plot():
-    simulation = Simulation('euler-cromer')
-    simulation.add_solar_system()
-    x_data = [[x/au for x in array] for array in simulation.x_data]
-    y_data = [[y/au for y in array] for array in simulation.y_data]
+def set_plot_style():
+    """Sets the fonts of the plots."""
+    import matplotlib
+    matplotlib.rcParams['mathtext.fontset'] = 'stix'
+    matplotlib.rcParams['font.family'] = 'STIXGeneral'
+    matplotlib.rcParams['font.size'] = 12
+
+def get_initial_positions_plot(trajectory_directory = None):
+    import matplotlib.pyplot as plt
+    set_plot_style()
+    # with the trajectory_directory of a streamed run, only its first sample
+    # is read from disk
+    if trajectory_directory:
+        simulation = Trajectory(trajectory_directory)
+        r_array = simulation.get_positions([0])[0]
+    else:
+        simulation = Simulation('euler-cromer')
+        simulation.add_solar_system()
+        r_array = simulation.r_array
+    x_data = [[x/au] for x in r_array[:,0]]
+    y_data = [[y/au] for y in r_array[:,1]]
     color_array = simulation.color_data
     for i in [x for x in range(simulation.nr_of_objects) if x!=4]:
          plt.scatter(x_data[i],y_data[i],
@@ -176,32 +202,41 @@ def generate_animation():
     # m = 317.8*m_earth # jupiter
     # m = m_sun
 
+    set_plot_style()
     simulation = Simulation('verlet')
     simulation.add_solar_system()
     add_asteriod(simulation, m)
     # add_asteriod_and_sun(simulation)
     simulation.time_step = day
     simulation.t_end = year*2
+    simulation.add_event('Earth', 'Asteriod')     # close approaches
     simulation.execute_simulation()
     simulation.generate_animation(simulation_duration = 10, show=True) #,filename=dated_filename+'.gif')
-    # print(min(simulation.distance_array)/384399*1000)
+    # closest approach in lunar distances
+    # print(min(event['distance'] for event in simulation.event_data)/(384399*1000))
 
 def energy_plot():
+    import matplotlib.pyplot as plt
+    set_plot_style()
     methods = ['euler', 'euler-cromer', 'verlet', 'runge-kutta']
     titles = ['Euler', 'Euler-Cromer','Verlet','Runge-Kutta']
     common_linewidth = 1
     c1,c2,c3 = [40/256,40/256,251/256], [59/256,122/256,87/256], [204/256,0,0]
-    for i in range(4):
-        method = methods[i]
 
-        # simulation
+    # simulations, executed in parallel
+    simulations = []
+    for method in methods:
         simulation = Simulation(method)
         simulation.add_solar_system()
         simulation.time_step = day*10
         # simulation.time_step = day*1
         simulation.t_end = 100*year
-        simulation.execute_simulation()
-        print('Currently at ' + method)
+        simulation.track_energy = True
+        simulations.append(simulation)
+    run_sweep(simulations)
+
+    for i in range(4):
+        simulation = simulations[i]
 
         # plot
         initial_total_energy = np.abs(simulation.total_energy_data[0])
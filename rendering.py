@@ -0,0 +1,102 @@
+import concurrent.futures
+import itertools
+import os
+import shutil
+import subprocess
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+# Frames rendered per task of a worker process, see render_movie(...)
+FRAMES_PER_TASK = 16
+
+def create_figure(positions, color_data, figure = None):
+    """Returns a 3D figure and its lines for the positions (frames,N,3) in
+    au, a grey trail and a colored marker per object. Without figure, a
+    figure that is not managed by pyplot is created, for rendering off
+    screen."""
+    if figure is None:
+        figure = Figure(figsize=(10,5), dpi=100)
+        FigureCanvasAgg(figure)
+    ax1 = figure.add_subplot(projection='3d')
+    ax1.set_xlim(-5, 5)
+    ax1.set_ylim(-5, 5)
+    ax1.set_zlim(-5, 5)
+    ax1.set_xlabel('x')
+    ax1.set_ylabel('y')
+    ax1.set_zlabel('z')
+    trails = [ax1.plot([], [], [], linewidth=0.5, color=[0.5,0.5,0.5])[0]
+            for _ in range(positions.shape[1])]
+    markers = [ax1.plot([], [], [], markersize=10, marker='.', c=color)[0]
+            for color in color_data]
+    return figure, trails + markers
+
+def draw_frame(i, lines, positions):
+    """Updates the lines of create_figure(...) to frame i of positions, with
+    the trails up to and the markers at that frame."""
+    N = positions.shape[1]
+    for j, line in enumerate(lines):
+        if j < N:
+            trail = positions[:i + 1,j]
+            line.set_data(trail[:,0], trail[:,1])
+            line.set_3d_properties(trail[:,2])
+        else:
+            line.set_data(positions[i,j - N,0:1], positions[i,j - N,1:2])
+            line.set_3d_properties(positions[i,j - N,2:3])
+    return lines
+
+def render_frames(positions, color_data, start, stop):
+    """Renders the frames start to stop off screen and returns them as
+    (height,width,3) uint8 RGB arrays."""
+    figure, lines = create_figure(positions, color_data)
+    frames = []
+    for i in range(start, stop):
+        draw_frame(i, lines, positions)
+        figure.canvas.draw()
+        frames.append(np.array(figure.canvas.buffer_rgba())[:,:,:3])
+    return frames
+
+def _iter_frames(positions, color_data, n_workers):
+    """Yields the rendered frames in order. With n_workers > 1 they are
+    rendered in worker processes, in tasks of FRAMES_PER_TASK frames."""
+    starts = range(0, len(positions), FRAMES_PER_TASK)
+    stops = [min(start + FRAMES_PER_TASK, len(positions)) for start in starts]
+    if n_workers == 1:
+        for start, stop in zip(starts, stops):
+            yield from render_frames(positions, color_data, start, stop)
+        return
+    with concurrent.futures.ProcessPoolExecutor(n_workers) as executor:
+        for frames in executor.map(render_frames, itertools.repeat(positions),
+                itertools.repeat(color_data), starts, stops):
+            yield from frames
+
+def render_movie(filename, positions, color_data, frame_interval = 30, n_workers = 1):
+    """Renders the positions (frames,N,3) in au to the movie filename, with
+    frame_interval ms per frame. GIFs are encoded with Pillow, other formats
+    by piping the raw frames to ffmpeg. With n_workers > 1, ranges of frames
+    are rendered in parallel worker processes."""
+    positions = np.asarray(positions, dtype=float)
+    frames = _iter_frames(positions, color_data, n_workers)
+    if os.path.splitext(str(filename))[1].lower() == '.gif':
+        from PIL import Image
+        images = [Image.fromarray(frame).quantize() for frame in frames]
+        images[0].save(filename, save_all=True, append_images=images[1:],
+                duration=frame_interval, loop=0)
+        return
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        raise ValueError('Writing %s requires ffmpeg, GIFs can be written without' % filename)
+    first_frame = next(frames)
+    height, width, _ = first_frame.shape
+    process = subprocess.Popen([ffmpeg, '-y', '-loglevel', 'error', '-f', 'rawvideo',
+            '-pix_fmt', 'rgb24', '-s', '%dx%d' % (width, height),
+            '-r', '%g' % (1000/frame_interval), '-i', '-', '-pix_fmt', 'yuv420p',
+            str(filename)], stdin=subprocess.PIPE)
+    try:
+        process.stdin.write(first_frame.tobytes())
+        for frame in frames:
+            process.stdin.write(frame.tobytes())
+    finally:
+        process.stdin.close()
+        if process.wait():
+            raise RuntimeError('ffmpeg failed to write %s' % filename)
@@ -1,9 +1,12 @@
-import matplotlib
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
-import mpl_toolkits.mplot3d.axes3d as p3
 import numpy as np
+import os
+import json
+import time
+import contextlib
+import concurrent.futures
 import math_functions
+import barnes_hut
+import trajectory
 
 mf = math_functions.math_functions()
 
@@ -41,6 +44,192 @@ v0_sun = [0,0,0]
 v0_earth = [0,velocity_earth,0]
 v0_asteriod = [0,-velocity_earth,0]
 
+def get_distances(r_array, targets = None, nr_of_sources = None, softening_length = 0):
+    """Returns the pairwise distances between the positions r_array (N,3) as
+    an (N,N) array, with inf on the diagonal. targets, nr_of_sources and
+    softening_length select rows and columns and soften the distances as in
+    get_accelerations(...)."""
+    r_sources = r_array[:nr_of_sources]
+    r_targets = r_array if targets is None else r_array[targets]
+    R = r_sources[np.newaxis,:,:] - r_targets[:,np.newaxis,:]
+    distances = np.sqrt(np.einsum('ijk,ijk->ij', R, R) + softening_length**2)
+    if targets is None:
+        diagonal = np.arange(min(distances.shape))
+        distances[diagonal,diagonal] = np.inf
+    else:
+        is_source = targets < len(r_sources)
+        distances[np.flatnonzero(is_source),targets[is_source]] = np.inf
+    return distances
+
+def get_accelerations(r_array, m_array, return_distances = False, targets = None,
+        nr_of_sources = None, softening_length = 0):
+    """Returns the gravitational accelerations of all objects as an (N,3)
+    array, given the positions r_array (N,3) and the masses m_array (N,).
+    All pairs are evaluated at once by broadcasting. With return_distances
+    the pairwise distances are returned as well, see get_distances(...). If
+    targets is an array of indices, only the accelerations of those objects
+    are returned, still due to all N objects. If nr_of_sources is given,
+    only the first nr_of_sources objects exert forces, and the distances
+    are an (N,nr_of_sources) array. Leading dimensions, such as (M,N,3) and
+    (M,N) for M independent systems, are evaluated in the same pass. With a
+    Plummer softening_length eps, the distances are sqrt(r**2 + eps**2), which
+    bounds the forces of close pairs."""
+    r_sources = r_array[...,:nr_of_sources,:]
+    m_sources = m_array[...,:nr_of_sources]
+    r_targets = r_array if targets is None else r_array[...,targets,:]
+    # R[i,j] = r_j - r_i
+    R = r_sources[...,np.newaxis,:,:] - r_targets[...,:,np.newaxis,:]
+    distances = np.sqrt(np.einsum('...ijk,...ijk->...ij', R, R) + softening_length**2)
+    # no self-force
+    if targets is None:
+        diagonal = np.arange(min(distances.shape[-2:]))
+        distances[...,diagonal,diagonal] = np.inf
+    else:
+        is_source = targets < r_sources.shape[-2]
+        distances[...,np.flatnonzero(is_source),targets[is_source]] = np.inf
+    k = G*m_sources[...,np.newaxis,:]/distances**3
+    a = np.einsum('...ij,...ijk->...ik', k, R)
+    if return_distances: return a, distances
+    return a
+
+def get_energies(v_array, m_array, distances):
+    """Returns the potential and kinetic energy of the system, given the
+    velocities v_array (N,3), masses m_array (N,) and the pairwise distances
+    from get_distances(...) or get_accelerations(...). For M systems, with
+    leading dimensions, the energies are (M,) arrays."""
+    m_sources = m_array[...,np.newaxis,:distances.shape[-1]]
+    potential_energy = -G/2*np.sum(m_array[...,:,np.newaxis]*m_sources/distances,
+            axis=(-2,-1))
+    kinetic_energy = 1/2*np.sum(m_array*np.einsum('...ij,...ij->...i', v_array, v_array),
+            axis=-1)
+    return potential_energy, kinetic_energy
+
+def _get_stumpff_functions(z):
+    """Returns the Stumpff functions C(z) and S(z) of the array z, using
+    their series for |z| < 0.1 to avoid cancellation."""
+    # series, C = sum (-z)**k/(2k+2)! and S = sum (-z)**k/(2k+3)!
+    C_series, S_series = 1/2, 1/6
+    term_C, term_S = 1/2, 1/6
+    for k in range(7):
+        term_C = term_C*(-z)/((2*k + 3)*(2*k + 4))
+        term_S = term_S*(-z)/((2*k + 4)*(2*k + 5))
+        C_series = C_series + term_C
+        S_series = S_series + term_S
+    # closed forms, trigonometric for z > 0 and hyperbolic for z < 0
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        s = np.sqrt(np.abs(z))
+        C = np.where(z > 0, 2*np.sin(s/2)**2, 2*np.sinh(s/2)**2)/np.abs(z)
+        S = np.where(z > 0, s - np.sin(s), np.sinh(s) - s)/s**3
+    small = np.abs(z) < 0.1
+    return np.where(small, C_series, C), np.where(small, S_series, S)
+
+def kepler_drift(r_array, v_array, mu, dt):
+    """Returns the positions and velocities (N,3) after a time dt of objects
+    in Keplerian orbits with positions r_array and velocities v_array relative
+    to a central mass with mu = G*M. Kepler's equation is solved with
+    universal variables, so elliptic and hyperbolic orbits are both handled."""
+    r_0 = np.linalg.norm(r_array, axis=-1)
+    v_r0 = np.einsum('ij,ij->i', r_array, v_array)/r_0
+    alpha = 2/r_0 - np.einsum('ij,ij->i', v_array, v_array)/mu
+    sqrt_mu = np.sqrt(mu)
+    # solve the universal Kepler equation F(chi) = 0 with Newton's method
+    chi = sqrt_mu*dt/r_0
+    for _ in range(50):
+        z = alpha*chi**2
+        C, S = _get_stumpff_functions(z)
+        F = (r_0*v_r0/sqrt_mu*chi**2*C + (1 - alpha*r_0)*chi**3*S
+                + r_0*chi - sqrt_mu*dt)
+        dF = (r_0*v_r0/sqrt_mu*chi*(1 - z*S) + (1 - alpha*r_0)*chi**2*C
+                + r_0)
+        delta = F/dF
+        chi -= delta
+        if np.all(np.abs(delta) <= 1e-15*np.abs(chi)): break
+    z = alpha*chi**2
+    C, S = _get_stumpff_functions(z)
+    # Lagrange coefficients
+    f = 1 - chi**2/r_0*C
+    g = dt - chi**3/sqrt_mu*S
+    r = f[:,np.newaxis]*r_array + g[:,np.newaxis]*v_array
+    r_norm = np.linalg.norm(r, axis=-1)
+    f_dot = sqrt_mu/(r_norm*r_0)*(alpha*chi**3*S - chi)
+    g_dot = 1 - chi**2/r_norm*C
+    v = f_dot[:,np.newaxis]*r_array + g_dot[:,np.newaxis]*v_array
+    return r, v
+
+# Butcher tableau of the Dormand-Prince 5(4) method, the last row of A is the
+# fifth order solution and E is its difference to the fourth order solution
+DORMAND_PRINCE_A = [
+    [],
+    [1/5],
+    [3/40, 9/40],
+    [44/45, -56/15, 32/9],
+    [19372/6561, -25360/2187, 64448/6561, -212/729],
+    [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656],
+    [35/384, 0, 500/1113, 125/192, -2187/6784, 11/84]
+]
+DORMAND_PRINCE_E = [71/57600, 0, -71/16695, 71/1920, -17253/339200, 22/525, -1/40]
+
+# Weights of the Verlet substeps of the symplectic composition methods
+cube_root_2 = 2**(1/3)
+YOSHIDA_4_WEIGHTS = [1/(2 - cube_root_2), -cube_root_2/(2 - cube_root_2), 1/(2 - cube_root_2)]
+_yoshida_6_w = [0.784513610477560, 0.235573213359357, -1.17767998417887] # solution A
+YOSHIDA_6_WEIGHTS = _yoshida_6_w + [1 - 2*sum(_yoshida_6_w)] + _yoshida_6_w[::-1]
+
+# Direct forces are only split over threads from this number of objects, see
+# Simulation._get_threaded_accelerations(...)
+MIN_THREADED_OBJECTS = 256
+# Rows of the distance matrix evaluated at once when no distances are
+# cached, see Simulation._iter_distances(...)
+DISTANCE_BLOCK_SIZE = 1024
+
+# Thread pools shared by all simulations, by number of threads
+_thread_pools = {}
+
+# Methods timed while profiling, with their phase, see
+# Simulation.start_profiling(). The time of a phase excludes the nested calls
+# of the other methods, so the time of the steps is that of the state update
+PROFILED_METHODS = {
+    '_get_accelerations': 'forces',
+    '_take_step': 'state update',
+    '_check_events': 'events',
+    '_store_positions': 'storage',
+    '_write_chunk': 'storage',
+    '_get_current_energies': 'energies',
+    '_execute_jit_kernels': 'compiled kernels',
+    'save_checkpoint': 'checkpoints',
+    'generate_animation': 'animation'
+}
+
+def _get_thread_pool(n_threads):
+    """Returns a thread pool with n_threads threads, created on first use."""
+    if n_threads not in _thread_pools:
+        _thread_pools[n_threads] = concurrent.futures.ThreadPoolExecutor(n_threads)
+    return _thread_pools[n_threads]
+
+# Settings stored in checkpoints, see Simulation.save_checkpoint(...)
+CHECKPOINT_SETTINGS = ['method', 'adaptive_time_step', 'tolerance', 'block_accuracy',
+        'max_block_level', 'force_backend', 'opening_angle', 'softening_length',
+        'encounter_radius', 'use_jit', 'n_threads', 'time_step', 't', 't_end',
+        'record_every', 'track_energy', 'dense_output', 'trajectory_file', 'trajectory_directory',
+        'chunk_size', 'checkpoint_file', 'checkpoint_every', 'nr_of_objects',
+        'nr_of_massive_objects', 'nr_of_samples', 'name_array', 'color_data', 'area_data',
+        'events', 'event_data', 'terminated_by']
+
+# Order of the methods, used by adaptive_step(...). For Dormand-Prince this is
+# the order of the embedded solution that controls the step size
+METHOD_ORDERS = {
+    'euler': 1,
+    'euler-cromer': 1,
+    'verlet': 2,
+    'runge-kutta': 4,
+    'dormand-prince': 4,
+    'block-verlet': 2,
+    'yoshida-4': 4,
+    'yoshida-6': 6,
+    'forest-ruth': 4,
+    'wisdom-holman': 2
+}
+
 class Simulation():
 
     def __init__(self, method = 'euler-cromer', adaptive_time_step = False):
@@ -87,324 +276,1189 @@ class Simulation():
             'euler': self.euler_step,
             'euler-cromer': self.euler_cromer_step,
             'verlet': self.verlet_step,
-            'runge-kutta': self.runge_kutta_step
+            'runge-kutta': self.runge_kutta_step,
+            'dormand-prince': self.dormand_prince_step,
+            'block-verlet': self.block_verlet_step,
+            'yoshida-4': self.yoshida_4_step,
+            'yoshida-6': self.yoshida_6_step,
+            'forest-ruth': self.forest_ruth_step,
+            'wisdom-holman': self.wisdom_holman_step
         }
         self.method_function = self.methods_dict[method]
+        # with adaptive_time_step, time_step is adjusted after every step so
+        # that the estimated local error stays below tolerance, relative to
+        # the size of the positions and velocities
         self.adaptive_time_step = adaptive_time_step
+        self.tolerance = 1e-9
+        # with 'block-verlet', objects take steps of time_step/2**level, see
+        # _get_block_levels(...)
+        self.block_accuracy = 0.01
+        self.max_block_level = 10
+        # forces are evaluated with 'direct' summation over all pairs, or
+        # with a 'barnes-hut' tree, see barnes_hut.py
+        self.force_backend = 'direct'
+        self.opening_angle = 0.5
+        # Plummer softening of the forces, see get_accelerations(...)
+        self.softening_length = 0
+        # pairs closer than encounter_radius are integrated as Keplerian two
+        # body problems, see encounter_step(...)
+        self.encounter_radius = None
+        self._encounter_pairs = None
+        # execute_simulation(...) runs the compiled kernels of jit_kernels.py
+        # with use_jit = True, the NumPy steppers with False, and the kernels
+        # whenever numba is installed and they support the settings with None
+        self.use_jit = None
+        # with n_threads > 1, the direct forces of many objects are evaluated
+        # by n_threads threads, see _get_threaded_accelerations(...)
+        self.n_threads = 1
 
         # standard time data
         self.time_step = day
         self.t = 0
         self.t_end = year
+        self.record_every = 1       # store every k-th step
+        self.track_energy = False   # store energies with every sample
+        # store velocities with every sample, so that positions_at(...)
+        # interpolates with cubic Hermite polynomials instead of linearly
+        self.dense_output = False
 
 
         self.nr_of_objects = 0
+        self.nr_of_massive_objects = 0
         # Data to input, stored in following variables using add_object(...)
+        # m_array, r_array and v_array are views into contiguous buffers
+        # that grow in chunks, see _reserve(...). The massive objects come
+        # first, followed by the massless test particles
         self.name_array = []
-        self.m_array = []
-        self.r_array = []
-        self.v_array = []
+        self._m_buffer = np.empty(0)
+        self._r_buffer = np.empty((0,3))
+        self._v_buffer = np.empty((0,3))
         self.color_data = []
         self.area_data = []
 
-        # Calculated data
-        self.x_data = []
-        self.y_data = []
-        self.z_data = []
-        self.t_data = [self.t]
-        self.distance_array = []    # between earth and asteriod
+        # Calculated data, positions and times are stored in buffers that
+        # execute_simulation(...) preallocates, see _reserve_samples(...)
+        self.trajectory_file = None # optional .npy file to memory map r_data to
+        # optional directory that the samples are written to in chunks of
+        # chunk_size, the buffers then only hold the samples since the last
+        # chunk, see load_trajectory(...)
+        self.trajectory_directory = None
+        self.chunk_size = 1024
+        self.nr_of_samples = 0
+        self._first_sample = 0      # first sample in the buffers
+        self._trajectory_writer = None
+        self._r_data = None
+        self._v_data = None
+        self._t_data = None
         self.kinetic_energy_data = []
         self.potential_energy_data = []
         self.total_energy_data = []
 
-    def add_object(self, name, m,r,v,c='k',A=None):
-        self.nr_of_objects += 1
-        if name == None: name = str(self.nr_of_objects)
-        self.name_array.append(name)
-        self.m_array.append(m)
-        self.r_array.append(r)
-        self.v_array.append(v)
+        # events between pairs of objects, see add_event(...), and the events
+        # that occurred, in order of time
+        self.events = []
+        self.event_data = []
+        self.terminated_by = None   # name of the terminal event that occurred
+
+        # optional .npz file that execute_simulation(...) saves a checkpoint
+        # to every checkpoint_every steps, see save_checkpoint(...)
+        self.checkpoint_file = None
+        self.checkpoint_every = 10000
+        self._step = 0              # steps taken by execute_simulation(...)
+
+        # times and counters per phase while profiling, see stats()
+        self._profile = None
+
+        # The latest force evaluation, reused when the positions, masses and
+        # force settings are unchanged, see _get_accelerations(...)
+        self._cached_r = None
+        self._cached_m = None
+        self._cached_settings = None
+        self._cached_a = None
+        self._cached_distances = None
+        self._cached_potentials = None
+
+    @property
+    def m_array(self):
+        """Masses of the objects, (N,) array."""
+        return self._m_buffer[:self.nr_of_objects]
+
+    @m_array.setter
+    def m_array(self, m):
+        self._m_buffer[:self.nr_of_objects] = m
+
+    @property
+    def r_array(self):
+        """Positions of the objects, (N,3) array."""
+        return self._r_buffer[:self.nr_of_objects]
+
+    @r_array.setter
+    def r_array(self, r):
+        self._r_buffer[:self.nr_of_objects] = r
+
+    @property
+    def v_array(self):
+        """Velocities of the objects, (N,3) array."""
+        return self._v_buffer[:self.nr_of_objects]
+
+    @v_array.setter
+    def v_array(self, v):
+        self._v_buffer[:self.nr_of_objects] = v
+
+    def _reserve(self, capacity):
+        """Grows the state buffers to hold at least capacity objects. The
+        capacity is at least doubled so that adding objects one by one is
+        amortized O(1)."""
+        old_capacity = len(self._m_buffer)
+        if capacity <= old_capacity: return
+        capacity = max(capacity, 2*old_capacity, 16)
+        n = self.nr_of_objects
+        m_buffer = np.zeros(capacity)
+        r_buffer = np.zeros((capacity,3))
+        v_buffer = np.zeros((capacity,3))
+        m_buffer[:n] = self._m_buffer[:n]
+        r_buffer[:n] = self._r_buffer[:n]
+        v_buffer[:n] = self._v_buffer[:n]
+        self._m_buffer, self._r_buffer, self._v_buffer = m_buffer, r_buffer, v_buffer
+
+    def add_object(self, name, m,r,v,c='k',A=None, test_particle=False):
+        """Adds an object with mass m, position r and velocity v. Test
+        particles feel the gravity of the massive objects but exert none, so
+        many of them only cost O(N) each. They are massless, m is ignored."""
+        self.add_objects([name], [m], [r], [v], [c], [A], test_particle)
+
+    def add_objects(self, names, m, r, v, c='k', A=None, test_particle=False):
+        """Adds K objects at once, with masses m (K,), positions r (K,3) and
+        velocities v (K,3). names, c and A are either lists with one entry per
+        object or shared by all objects, see add_object(...)."""
+        if self.nr_of_samples > 0:
+            raise ValueError('Objects can not be added after the simulation has started')
+        r = np.array(r, dtype=float).reshape(-1,3)
+        v = np.array(v, dtype=float).reshape(-1,3)
+        K = len(r)
+        m = np.zeros(K) if test_particle else np.broadcast_to(np.array(m, dtype=float), K)
+        def per_object(x, is_color = False):
+            """Returns x as a list with one entry per object. A single color
+            can itself be a list of numbers, such as [0.9,0.9,0]."""
+            if isinstance(x, (list, tuple, np.ndarray)) and len(x) == K:
+                if (not is_color or K == 1 or isinstance(x[0], str)
+                        or not np.isscalar(x[0])):
+                    return list(x)
+            return [x]*K
+        names, c, A = per_object(names), per_object(c, True), per_object(A)
+        n = self.nr_of_objects
+        names = [str(n + k + 1) if name == None else name for k, name in enumerate(names)]
 
-        self.x_data.append([r[0]])
-        self.y_data.append([r[1]])
-        self.z_data.append([r[2]])
+        # insert massive objects before the test particles
+        index = n if test_particle else self.nr_of_massive_objects
+        self._reserve(n + K)
+        for buffer, values in ((self._m_buffer, m), (self._r_buffer, r), (self._v_buffer, v)):
+            buffer[index+K:n+K] = buffer[index:n]
+            buffer[index:index+K] = values
+        self.name_array[index:index] = names
+        self.color_data[index:index] = c
+        self.area_data[index:index] = A
+        self.nr_of_objects += K
+        if not test_particle: self.nr_of_massive_objects += K
 
-        self.color_data.append(c)
-        self.area_data.append(A)
+    @property
+    def r_data(self):
+        """Read-only view of the stored positions, (samples,N,3) array. Before
+        the simulation is executed this holds the initial positions only. With
+        trajectory_directory, only the samples not yet written to it."""
+        if self._r_data is None:
+            r_data = self.r_array[np.newaxis]
+        else:
+            r_data = self._r_data[:self.nr_of_samples - self._first_sample]
+        r_data = r_data.view()
+        r_data.flags.writeable = False
+        return r_data
+
+    @property
+    def x_data(self):
+        """Read-only view of the stored x-coordinates, x_data[i] is the
+        trajectory of object i."""
+        return self.r_data[:,:,0].T
+
+    @property
+    def y_data(self):
+        """Read-only view of the stored y-coordinates."""
+        return self.r_data[:,:,1].T
+
+    @property
+    def z_data(self):
+        """Read-only view of the stored z-coordinates."""
+        return self.r_data[:,:,2].T
+
+    @property
+    def t_data(self):
+        """Read-only view of the times of the stored samples."""
+        if self._t_data is None:
+            t_data = np.array([self.t], dtype=float)
+        else:
+            t_data = self._t_data[:self.nr_of_samples - self._first_sample].view()
+        t_data.flags.writeable = False
+        return t_data
+
+    @property
+    def v_data(self):
+        """Read-only view of the stored velocities, like r_data, with
+        dense_output. None otherwise."""
+        if self._v_data is None:
+            if not self.dense_output or self._r_data is not None: return None
+            v_data = self.v_array[np.newaxis]
+        else:
+            v_data = self._v_data[:self.nr_of_samples - self._first_sample]
+        v_data = v_data.view()
+        v_data.flags.writeable = False
+        return v_data
+
+    def positions_at(self, times):
+        """Returns the positions (times,N,3) at any times between the stored
+        samples, interpolated with cubic Hermite polynomials with
+        dense_output and linearly otherwise. A run can then take long steps
+        and still be evaluated at e.g. the frame times of an animation. With
+        trajectory_directory, see load_trajectory().positions_at(...)."""
+        r_data, v_data = self.r_data, self.v_data
+        return trajectory.interpolate_positions(times, self.t_data,
+                lambda k: (r_data[k], None if v_data is None else v_data[k]))
+
+    def _reserve_samples(self, capacity, exact = False):
+        """Grows the trajectory buffers to hold at least capacity samples, or
+        with exact resizes them to capacity samples. If trajectory_file is
+        set, r_data is memory mapped to that .npy file. The velocities are
+        only stored with dense_output, in memory."""
+        if exact:
+            if self._r_data is None or len(self._r_data) == capacity: return
+        elif (self._r_data is not None and len(self._r_data) >= capacity
+                and (self._v_data is not None or not self.dense_output)): return
+        else:
+            capacity = max(capacity, 0 if self._r_data is None else len(self._r_data))
+        n = self.nr_of_samples - self._first_sample
+        shape = (capacity,) + self.r_array.shape
+        if self.trajectory_file:
+            # write to a new file and swap it in, the old map stays readable
+            path = str(self.trajectory_file)
+            r_data = np.lib.format.open_memmap(path + '.tmp', mode='w+',
+                    dtype=float, shape=shape)
+        else:
+            r_data = np.empty(shape)
+        t_data = np.empty(capacity)
+        v_data = np.empty(shape) if self.dense_output else None
+        if n:
+            r_data[:n] = self._r_data[:n]
+            t_data[:n] = self._t_data[:n]
+            if self.dense_output:
+                # samples stored before dense_output was set have no
+                # velocities, positions_at(...) interpolates them linearly
+                v_data[:n] = np.nan if self._v_data is None else self._v_data[:n]
+        if self.trajectory_file: os.replace(path + '.tmp', path)
+        self._r_data, self._v_data, self._t_data = r_data, v_data, t_data
+
+    def _make_room_for_sample(self):
+        """Makes room for the next sample when the trajectory buffers are full,
+        by writing them to trajectory_directory or by growing them."""
+        n = self.nr_of_samples - self._first_sample
+        if self._r_data is not None and n < len(self._r_data): return
+        if self.trajectory_directory and n:
+            self._write_chunk()
+        else:
+            self._reserve_samples(max(2*n, 16))
+
+    def _write_chunk(self):
+        """Writes the samples in the buffers, and their energies, as the next
+        chunk to trajectory_directory and empties the buffers."""
+        n = self.nr_of_samples - self._first_sample
+        if n == 0: return
+        if self._trajectory_writer is None:
+            self._trajectory_writer = trajectory.TrajectoryWriter(self.trajectory_directory,
+                    self.name_array, self.color_data, self.area_data, self._first_sample)
+        energy_data = None
+        if self.track_energy:
+            energy_data = np.column_stack([self.potential_energy_data,
+                    self.kinetic_energy_data, self.total_energy_data])
+            self.potential_energy_data = []
+            self.kinetic_energy_data = []
+            self.total_energy_data = []
+        v_data = None if self._v_data is None else self._v_data[:n]
+        self._trajectory_writer.write(self._t_data[:n], self._r_data[:n], energy_data, v_data)
+        self._first_sample = self.nr_of_samples
+
+    def load_trajectory(self):
+        """Returns a lazy reader of the samples written to
+        trajectory_directory, see trajectory.Trajectory."""
+        return trajectory.Trajectory(self.trajectory_directory)
 
     def execute_simulation(self):
-        self.potential_energy_data.append(self._get_current_potential_energy())
-        self.kinetic_energy_data.append(self._get_current_kinetic_energy())
-        self.total_energy_data.append(self._get_current_total_energy())
-        while self.t < self.t_end:
-            self.method_function()
+        """Integrates from t to t_end. Every record_every-th step, and the
+        last step, is stored with store_current_iteration(...). If
+        checkpoint_file is set, a checkpoint is saved to it every
+        checkpoint_every steps and at the end, see save_checkpoint(...)."""
+        nr_of_steps = max(int(np.ceil((self.t_end - self.t)/self.time_step)), 0)
+        if self.trajectory_directory:
+            self._reserve_samples(self.chunk_size)
+        else:
+            self._reserve_samples(self.nr_of_samples + nr_of_steps//self.record_every + 2)
+        if self.nr_of_samples == 0:
             self.store_current_iteration()
+        self.terminated_by = None
+        while self.t < self.t_end and self.terminated_by is None:
+            if self.checkpoint_file:
+                stop_step = (self._step//self.checkpoint_every + 1)*self.checkpoint_every
+            else:
+                stop_step = np.iinfo(np.int64).max
+            if self._use_jit_kernels():
+                self._execute_jit_kernels(stop_step)
+            else:
+                self._execute_steps(stop_step)
+            if self.checkpoint_file:
+                self.save_checkpoint(self.checkpoint_file)
+        self._step = 0
+        if self.trajectory_directory:
+            self._write_chunk()
+        elif self.trajectory_file:
+            # the file holds exactly the stored samples, so it can be read
+            # with np.load(trajectory_file)
+            self._reserve_samples(self.nr_of_samples, exact=True)
+        if isinstance(self._r_data, np.memmap): self._r_data.flush()
 
-    def _get_current_potential_energy(self):
-        """Returns the current potential energy of the system."""
-        G = 6.674e-11           # 6.674*10^(−11) N*(m/kg)^2
-        potential_energy = 0
-        if self.nr_of_objects <= 1: return 0
-        for i in range(1,self.nr_of_objects):
-            for j in range(0, i-1):
-                r_ij = mf.norm([x-y for x,y in zip(self.r_array[j], self.r_array[i])])
-                potential_energy += -G*self.m_array[i]*self.m_array[j]/r_ij
-        return potential_energy
-
-    def _get_current_kinetic_energy(self):
-        """Returns the current kinetic energy of the system."""
-        kinetic_energy = 0
-        for i in range(self.nr_of_objects):
-            kinetic_energy += self.m_array[i]*mf.norm(self.v_array[i])**2
-        return kinetic_energy/2
-
-
-    def _get_current_total_energy(self):
-        """Returns the current total energy of the system."""
-        return self._get_current_potential_energy()+self._get_current_kinetic_energy()
+    def _execute_steps(self, stop_step):
+        """Takes steps with method_function, or adaptive_step(), until t_end
+        or until _step reaches stop_step."""
+        step_function = self._get_step_function()
+        while self.t < self.t_end and self._step < stop_step:
+            self._take_step(step_function)
+            self._step += 1
+            if (self._step % self.record_every == 0 or self.t >= self.t_end
+                    or self.terminated_by is not None):
+                self.store_current_iteration()
+            if self.terminated_by is not None: break
+
+    def _get_step_function(self):
+        """Returns the function that takes one step: adaptive_step() with
+        adaptive_time_step, encounter_step() with encounter_radius and
+        method_function otherwise."""
+        if self.encounter_radius and self.method == 'wisdom-holman':
+            raise ValueError('Encounters can not be split off with wisdom-holman')
+        if self.adaptive_time_step: return self.adaptive_step
+        return self._get_fixed_step_function()
+
+    def _get_fixed_step_function(self):
+        """Returns the function that takes one step of time_step:
+        encounter_step() with encounter_radius and method_function
+        otherwise."""
+        if self.encounter_radius: return self.encounter_step
+        return self.method_function
+
+    def _take_step(self, step_function):
+        """Takes one step with step_function and checks the events."""
+        if not self.events:
+            step_function()
+            return
+        t_0, r_0, v_0 = self.t, np.copy(self.r_array), np.copy(self.v_array)
+        step_function()
+        self._check_events(t_0, r_0, v_0)
+
+    def add_event(self, body_1, body_2, distance = None, terminal = False, name = None):
+        """Registers an event between the objects named body_1 and body_2.
+        Without distance, every close approach, i.e. local minimum of their
+        distance, is an event. With distance, every crossing of that distance
+        is an event. A terminal event, such as a collision, stops the
+        integration at the event. The events are checked after every step and
+        located within the step by bisection on the cubic Hermite
+        interpolation of the step, so they are resolved much finer than the
+        time step. Every event that occurs is appended to event_data as a
+        dict with the name, time t, distance and the positions r (2,3) and
+        velocities v (2,3) of both objects."""
+        if name is None:
+            name = '%s-%s %s' % (body_1, body_2, 'approach' if distance is None else distance)
+        self.events.append({'name': name, 'body_1': body_1, 'body_2': body_2,
+                'distance': distance, 'terminal': terminal})
+
+    def _get_event_functions(self, R, V, distances):
+        """Returns the event functions for the relative positions R (K,3) and
+        velocities V of the pairs of K events, which change sign at the
+        events: R.V for close approaches, where distances is nan, and
+        |R| - distances otherwise."""
+        return np.where(np.isnan(distances), np.einsum('ij,ij->i', R, V),
+                np.linalg.norm(R, axis=-1) - distances)
+
+    def _check_events(self, t_0, r_0, v_0):
+        """Finds the events in the step from t_0, r_0, v_0 to the current
+        state and stores them in event_data. At a terminal event, the state is
+        set back to the event and terminated_by is set."""
+        i = np.array([self.name_array.index(event['body_1']) for event in self.events])
+        j = np.array([self.name_array.index(event['body_2']) for event in self.events])
+        r_1, v_1 = self.r_array, self.v_array
+        R_0, V_0 = r_0[j] - r_0[i], v_0[j] - v_0[i]
+        R_1, V_1 = r_1[j] - r_1[i], v_1[j] - v_1[i]
+        distances = np.array([np.nan if event['distance'] is None else event['distance']
+                for event in self.events], dtype=float)
+        g_0 = self._get_event_functions(R_0, V_0, distances)
+        g_1 = self._get_event_functions(R_1, V_1, distances)
+        occurred = np.where(np.isnan(distances), (g_0 < 0) & (g_1 >= 0),
+                (g_0 < 0) != (g_1 < 0))
+        if not np.any(occurred): return
+        dt = self.t - t_0
+        k = np.flatnonzero(occurred)
+        theta_low, theta_high = np.zeros(len(k)), np.ones(len(k))
+        for _ in range(52):
+            theta = (theta_low + theta_high)/2
+            R, V = trajectory.hermite_interpolation(theta, dt, R_0[k], V_0[k], R_1[k], V_1[k])
+            g = self._get_event_functions(R, V, distances[k])
+            before = (g < 0) == (g_0[k] < 0)
+            theta_low = np.where(before, theta, theta_low)
+            theta_high = np.where(before, theta_high, theta)
+        theta = theta_high
+        # events in order of time, up to the first terminal event
+        for theta_k, k_k in sorted(zip(theta, k)):
+            pair = [i[k_k], j[k_k]]
+            r, v = trajectory.hermite_interpolation(theta_k, dt, r_0[pair], v_0[pair], r_1[pair], v_1[pair])
+            event = self.events[k_k]
+            self.event_data.append({'name': event['name'], 't': t_0 + theta_k*dt,
+                    'distance': np.linalg.norm(r[1] - r[0]), 'r': r, 'v': v})
+            if event['terminal']:
+                # just past the event, so that it is not found again when the
+                # integration is continued
+                theta_k = min(theta_k + 1e-9, 1)
+                r, v = trajectory.hermite_interpolation(theta_k, dt, r_0, v_0, r_1, v_1)
+                self.r_array, self.v_array = r, v
+                self.t = t_0 + theta_k*dt
+                self.terminated_by = event['name']
+                return
+
+    def save_checkpoint(self, path):
+        """Saves the state, settings, stored trajectory and energies to the
+        .npz file path, from which load_checkpoint(...) restores the
+        simulation. The file is replaced atomically, so an interrupted save
+        keeps the previous checkpoint. With trajectory_file, the positions
+        stay in that file and only its name is saved, with
+        trajectory_directory only the samples not yet written to it are
+        saved."""
+        n = self.nr_of_samples - self._first_sample
+        settings = {key: getattr(self, key) for key in CHECKPOINT_SETTINGS}
+        for key in ['trajectory_file', 'trajectory_directory', 'checkpoint_file']:
+            if settings[key]: settings[key] = str(settings[key])
+        settings['step'] = self._step
+        settings['first_sample'] = self._first_sample
+        arrays = {
+            'm_array': self.m_array,
+            'r_array': self.r_array,
+            'v_array': self.v_array,
+            't_data': self.t_data if n else np.empty(0),
+            'energy_data': np.column_stack([self.potential_energy_data,
+                    self.kinetic_energy_data, self.total_energy_data]).reshape(-1,3)
+        }
+        if self.trajectory_file:
+            if isinstance(self._r_data, np.memmap): self._r_data.flush()
+        elif n:
+            arrays['r_data'] = self.r_data
+        if n and self._v_data is not None:
+            arrays['v_data'] = self.v_data
+        path = str(path)
+        with open(path + '.tmp', 'wb') as file:
+            np.savez(file, settings=json.dumps(settings,
+                    default=lambda x: np.asarray(x).tolist()), **arrays)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load_checkpoint(cls, path):
+        """Returns the simulation saved with save_checkpoint(...) to path.
+        execute_simulation() then continues from the saved t."""
+        with np.load(path, allow_pickle=False) as data:
+            settings = json.loads(str(data['settings']))
+            simulation = cls(settings.pop('method'), settings.pop('adaptive_time_step'))
+            simulation._step = settings.pop('step')
+            simulation._first_sample = settings.pop('first_sample')
+            for event in settings['event_data']:
+                event['r'], event['v'] = np.array(event['r']), np.array(event['v'])
+            for key, value in settings.items():
+                setattr(simulation, key, value)
+            simulation._m_buffer = np.array(data['m_array'])
+            simulation._r_buffer = np.array(data['r_array'])
+            simulation._v_buffer = np.array(data['v_array'])
+            n = simulation.nr_of_samples - simulation._first_sample
+            if n:
+                if simulation.trajectory_file:
+                    simulation._r_data = np.load(simulation.trajectory_file, mmap_mode='r+')
+                else:
+                    simulation._r_data = np.array(data['r_data'])
+                # the time buffer has the capacity of the position buffer
+                simulation._t_data = np.empty(len(simulation._r_data))
+                simulation._t_data[:n] = data['t_data']
+                if 'v_data' in data:
+                    simulation._v_data = np.empty(simulation._r_data.shape)
+                    simulation._v_data[:n] = data['v_data']
+            energies = data['energy_data']
+            simulation.potential_energy_data = list(energies[:,0])
+            simulation.kinetic_energy_data = list(energies[:,1])
+            simulation.total_energy_data = list(energies[:,2])
+        return simulation
+
+    def iter_steps(self, batch = 1):
+        """Integrates from t to t_end like execute_simulation(), but yields
+        after every batch steps instead of storing samples. Every item is
+        (t, r, v), with read-only views of the current positions and
+        velocities, which are valid until the next item. The loop can be
+        stopped at any time, the simulation then stays at that state."""
+        use_jit_kernels = self._use_jit_kernels()
+        if use_jit_kernels:
+            import jit_kernels
+            method = jit_kernels.METHOD_IDS[self.method]
+            coefficients = self._get_jit_coefficients()
+            # the kernel stores no samples but the last, into a scratch buffer
+            t_data, r_data = np.empty(1), np.empty((1,) + self.r_array.shape)
+            no_samples = np.iinfo(np.int64).max
+        step_function = self._get_step_function()
+        self.terminated_by = None
+        while self.t < self.t_end and self.terminated_by is None:
+            if use_jit_kernels:
+                self.t, _, _ = jit_kernels.run(method, coefficients, self.r_array,
+                        self.v_array, self.m_array, self.nr_of_massive_objects,
+                        float(self.softening_length), float(self.t), float(self.t_end),
+                        float(self.time_step), 0, batch,
+                        no_samples, False, t_data, r_data, r_data[:0], np.empty((0,3)), 0)
+            else:
+                for _ in range(batch):
+                    if self.t >= self.t_end or self.terminated_by is not None: break
+                    self._take_step(step_function)
+            r, v = self.r_array.view(), self.v_array.view()
+            r.flags.writeable = False
+            v.flags.writeable = False
+            yield self.t, r, v
+
+    def _use_jit_kernels(self):
+        """Returns whether execute_simulation() runs the compiled kernels, see
+        use_jit. They cover the fixed step methods with the direct force
+        backend, except block-verlet, and do not check events or encounters.
+        jit_kernels, and with it numba, is only imported here, as importing
+        numba takes longer than the rest of the module."""
+        if self.use_jit is not None and not self.use_jit: return False
+        import jit_kernels
+        supported = (self.method in jit_kernels.METHOD_IDS and not self.adaptive_time_step
+                and self.force_backend == 'direct' and self.r_array.ndim == 2
+                and not self.events and not self.encounter_radius)
+        if self.use_jit is None:
+            # the kernels are single threaded
+            return jit_kernels.AVAILABLE and supported and not self._use_threads()
+        if not jit_kernels.AVAILABLE:
+            raise ValueError('use_jit requires numba')
+        if not supported:
+            raise ValueError('No compiled kernel for method %s with these settings' % self.method)
+        return True
+
+    def _get_jit_coefficients(self):
+        """Returns the coefficients of method for jit_kernels.run(...), the
+        Butcher tableau of Dormand-Prince or the substep weights of the
+        composition methods."""
+        if self.method == 'dormand-prince':
+            coefficients = np.zeros((7,6))
+            for i, A_i in enumerate(DORMAND_PRINCE_A):
+                coefficients[i,:len(A_i)] = A_i
+            return coefficients
+        weights = {'yoshida-4': YOSHIDA_4_WEIGHTS, 'yoshida-6': YOSHIDA_6_WEIGHTS,
+                'forest-ruth': YOSHIDA_4_WEIGHTS}.get(self.method, [0])
+        return np.array([weights], dtype=float)
+
+    def _execute_jit_kernels(self, stop_step):
+        """Integrates from t to t_end, or until _step reaches stop_step, with
+        the compiled kernel of method, which loops over all steps and writes
+        the samples directly into the trajectory buffers."""
+        import jit_kernels
+        method = jit_kernels.METHOD_IDS[self.method]
+        coefficients = self._get_jit_coefficients()
+        while self.t < self.t_end and self._step < stop_step:
+            self._make_room_for_sample()
+            n = self.nr_of_samples - self._first_sample
+            energy_data = np.empty((len(self._t_data) if self.track_energy else 0, 3))
+            v_data = self._v_data if self._v_data is not None else np.empty((0,) + self.v_array.shape)
+            self.t, self._step, nr_of_samples = jit_kernels.run(method, coefficients,
+                    self.r_array, self.v_array, self.m_array, self.nr_of_massive_objects,
+                    float(self.softening_length), float(self.t), float(self.t_end),
+                    float(self.time_step), self._step, stop_step, self.record_every,
+                    self.track_energy, self._t_data, np.asarray(self._r_data), v_data,
+                    energy_data, n)
+            self.nr_of_samples = self._first_sample + nr_of_samples
+            if self.track_energy:
+                energies = energy_data[n:nr_of_samples]
+                self.potential_energy_data.extend(energies[:,0])
+                self.kinetic_energy_data.extend(energies[:,1])
+                self.total_energy_data.extend(energies[:,2])
+
+    def _get_accelerations(self, r, targets = None):
+        """Returns the accelerations at positions r, of all objects or only of
+        the objects with indices targets, evaluated with force_backend. The
+        accelerations of all objects and the pairwise distances (direct) or
+        potentials (barnes-hut and threaded direct) are cached, so the next
+        call at the same positions and force settings (e.g. the first
+        evaluation of the next Verlet step) and the energy diagnostics reuse
+        them. During an encounter_step(), the forces within the encounter
+        pairs are left out."""
+        m = self.m_array
+        if self.force_backend not in ('direct', 'barnes-hut'):
+            raise ValueError('Unknown force backend: %s' % self.force_backend)
+        barnes_hut_backend = self.force_backend == 'barnes-hut'
+        if targets is not None:
+            if barnes_hut_backend:
+                a = barnes_hut.get_accelerations(r, m, self.opening_angle, targets,
+                        softening_length=self.softening_length)
+            else:
+                a = get_accelerations(r, m, targets=targets,
+                        nr_of_sources=self.nr_of_massive_objects,
+                        softening_length=self.softening_length)
+            if self._encounter_pairs is not None:
+                a -= self._get_pair_accelerations(r)[targets]
+            return a
+        settings = (self.force_backend, self.opening_angle, self.softening_length,
+                self._use_threads())
+        if (self._cached_a is None or not np.array_equal(r, self._cached_r)
+                or not np.array_equal(m, self._cached_m) or settings != self._cached_settings):
+            if barnes_hut_backend:
+                a, potentials = barnes_hut.get_accelerations(r, m, self.opening_angle,
+                        return_potentials=True, softening_length=self.softening_length)
+                distances = None
+            elif self._use_threads():
+                a, potentials = self._get_threaded_accelerations(r)
+                distances = None
+            else:
+                a, distances = get_accelerations(r, m, return_distances=True,
+                        nr_of_sources=self.nr_of_massive_objects,
+                        softening_length=self.softening_length)
+                potentials = None
+            a.flags.writeable = False
+            self._cached_r, self._cached_m = np.copy(r), np.copy(m)
+            self._cached_settings = settings
+            self._cached_a = a
+            self._cached_distances, self._cached_potentials = distances, potentials
+        if self._encounter_pairs is not None:
+            return self._cached_a - self._get_pair_accelerations(r)
+        return self._cached_a
+
+    def _use_threads(self):
+        """Returns whether the direct forces are split over n_threads threads."""
+        return (self.n_threads > 1 and self.r_array.ndim == 2
+                and self.nr_of_objects >= MIN_THREADED_OBJECTS)
+
+    def _get_threaded_accelerations(self, r):
+        """Returns the direct accelerations and gravitational potentials at
+        positions r. The rows of the interaction matrix are split into blocks
+        that n_threads threads evaluate in parallel, with the compiled kernel
+        if numba is installed and with NumPy otherwise. Both release the GIL
+        while computing."""
+        import jit_kernels
+        m, nr_of_sources = self.m_array, self.nr_of_massive_objects
+        N = len(r)
+        a = np.empty((N,3))
+        potentials = np.empty(N)
+        # a few blocks per thread to balance the load, at most 1024 rows to
+        # bound the memory of the NumPy evaluation
+        block_size = min(-(-N//(4*self.n_threads)), 1024)
+        def evaluate_rows(start):
+            stop = min(start + block_size, N)
+            if jit_kernels.AVAILABLE:
+                jit_kernels.get_row_accelerations(r, m, nr_of_sources,
+                        self.softening_length, start, stop, a, potentials)
+            else:
+                a[start:stop], distances = get_accelerations(r, m, return_distances=True,
+                        targets=np.arange(start, stop), nr_of_sources=nr_of_sources,
+                        softening_length=self.softening_length)
+                potentials[start:stop] = -G*np.sum(m[:nr_of_sources]/distances, axis=1)
+        thread_pool = _get_thread_pool(self.n_threads)
+        list(thread_pool.map(evaluate_rows, range(0, N, block_size)))
+        return a, potentials
+
+    def _get_current_energies(self):
+        """Returns the current potential and kinetic energy of the system."""
+        self._get_accelerations(self.r_array)
+        if self._cached_distances is None:
+            m, v = self.m_array, self.v_array
+            potential_energy = 1/2*np.sum(m*self._cached_potentials)
+            kinetic_energy = 1/2*np.sum(m*np.einsum('ij,ij->i', v, v))
+            return potential_energy, kinetic_energy
+        return get_energies(self.v_array, self.m_array, self._cached_distances)
+
+    def get_force_accuracy_report(self, opening_angles = (0.2, 0.5, 0.8, 1.0)):
+        """Returns the accuracy and wall time of the Barnes-Hut accelerations
+        for the current state and every opening angle, compared to the direct
+        sum, see barnes_hut.get_accuracy_report(...)."""
+        return barnes_hut.get_accuracy_report(self.r_array, self.m_array, opening_angles)
+
+    def _store_positions(self):
+        """Stores the current time and positions, and with dense_output the
+        velocities, as the next sample."""
+        self._make_room_for_sample()
+        n = self.nr_of_samples - self._first_sample
+        self._t_data[n] = self.t
+        self._r_data[n] = self.r_array
+        if self._v_data is not None: self._v_data[n] = self.v_array
+        self.nr_of_samples += 1
 
     def store_current_iteration(self):
-        self.t_data.append(self.t)
-        self.potential_energy_data.append(self._get_current_potential_energy())
-        self.kinetic_energy_data.append(self._get_current_kinetic_energy())
-        self.total_energy_data.append(self._get_current_total_energy())
-        for i in range(self.nr_of_objects):
-            r = self.r_array[i]
-            self.x_data[i].append(r[0])
-            self.y_data[i].append(r[1])
-            self.z_data[i].append(r[2])
+        self._store_positions()
+        if self.track_energy:
+            potential_energy, kinetic_energy = self._get_current_energies()
+            self.potential_energy_data.append(potential_energy)
+            self.kinetic_energy_data.append(kinetic_energy)
+            self.total_energy_data.append(potential_energy + kinetic_energy)
 
     def euler_step(self):
         self.t += self.time_step
-        # iterate through the objects
-        for i in range(self.nr_of_objects):
-            r_array = np.copy(self.r_array)
-            j_range = [j for j in range(self.nr_of_objects) if j != i]
-            # calculate acceleration
-            a_i = [0,0,0]
-            for j in j_range:
-                a_i = mf.vector_add([
-                    a_i,
-                    self._get_a_ij(self.m_array[j],r_array[j],r_array[i])
-                ])
-            # update r
-            self.r_array[i] = mf.vector_add([
-                    self.r_array[i],
-                    [v_i_i*self.time_step for v_i_i in self.v_array[i]]
-            ])
-            # update v
-            self.v_array[i] = mf.vector_add([
-                    self.v_array[i],
-                    [a_i_i*self.time_step for a_i_i in a_i]
-            ])
+        r, v = self.r_array, self.v_array
+        a = self._get_accelerations(r)
+        # update r with the old v, then v with the old a
+        r += v*self.time_step
+        v += a*self.time_step
 
     def euler_cromer_step(self):
         self.t += self.time_step
-        # iterate through the objects
-        r_array = np.copy(self.r_array)
-        for i in range(self.nr_of_objects):
-            j_range = [j for j in range(self.nr_of_objects) if j != i]
-            # calculate acceleration
-            a_i = [0,0,0]
-            for j in j_range:
-                a_i = mf.vector_add([
-                    a_i,
-                    self._get_a_ij(self.m_array[j],r_array[j],r_array[i])
-                ])
-            # update v
-            self.v_array[i] = mf.vector_add([
-            self.v_array[i],
-            [a_i_i*self.time_step for a_i_i in a_i]
-            ])
-            # update r
-            self.r_array[i] = mf.vector_add([
-                    self.r_array[i],
-                    [v_i_i*self.time_step for v_i_i in self.v_array[i]]
-            ])
+        r, v = self.r_array, self.v_array
+        a = self._get_accelerations(r)
+        # update v, then r with the new v
+        v += a*self.time_step
+        r += v*self.time_step
 
     def verlet_step(self):
-        print(self.t)
         self.t += self.time_step
-        # iterate through the objects
-        r_array = np.copy(self.r_array)
-        for i in range(self.nr_of_objects):
-            j_range = [j for j in range(self.nr_of_objects) if j != i]
-            # calculate acceleration
-            a_1 = [0,0,0]
-            for j in j_range:
-                a_1 = mf.vector_add([
-                    a_1,
-                    self._get_a_ij(self.m_array[j],r_array[j],r_array[i])
-                ])
-            # update r
-            self.r_array[i] = mf.vector_add([
-                    self.r_array[i],
-                    [v_i_i*self.time_step for v_i_i in self.v_array[i]],
-                    [1/2*a_1_i*(self.time_step**2) for a_1_i in a_1]
-            ])
-            # calculate acceleration at new r
-            a_2 = [0,0,0]
-            for j in j_range:
-                a_2 = mf.vector_add([
-                    a_2,
-                    self._get_a_ij(self.m_array[j],r_array[j],self.r_array[i])
-                ])
-            # update v
-            self.v_array[i] = mf.vector_add([
-                    self.v_array[i],
-                    [1/2*a_1_i*self.time_step for a_1_i in a_1],
-                    [1/2*a_2_i*self.time_step for a_2_i in a_2]
-            ])
-            # uncomment when finding distance between asteriod and earth
-            # R = [(self.r_array[3][i]-self.r_array[9][i]) for i in range(3)]
-            # self.distance_array(mf.norm(R))
+        dt = self.time_step
+        r, v = self.r_array, self.v_array
+        a_1 = self._get_accelerations(r)
+        # update r
+        r += v*dt + 1/2*a_1*dt**2
+        # calculate acceleration at new r
+        a_2 = self._get_accelerations(r)
+        # update v
+        v += 1/2*(a_1 + a_2)*dt
 
 
     def runge_kutta_step(self):
         self.t += self.time_step
-        # iterate through the objects
-        for i in range(self.nr_of_objects):
-            # j_range is index for all objects other than i
-            j_range = [j for j in range(self.nr_of_objects) if j != i]
-
-            r = [x for x in self.r_array[i]]    # r(t)
-            v = [x for x in self.v_array[i]]    # v(t)
-
-            # a_1,b_1,...,a_4,b_4
-            a_1 = [0,0,0]                       # = a(r(t))Dt
-            for j in j_range:
-                a_1 = mf.vector_add([
-                    a_1,
-                    self._get_a_ij(self.m_array[j],self.r_array[j],r)
-                ])
-            a_1 = mf.vector_scale(a_1,self.time_step)
-            b_1 = mf.vector_scale(v,self.time_step) # = v(t)Dt
-
-            r_2 = [r_i+b_1i/2 for r_i,b_1i in zip(r,b_1)] # = r(t)+b_1/2
-            a_2 = [0,0,0]                       # = a(r_2)Dt
-            for j in j_range:
-                a_2 = mf.vector_add([
-                    a_2,
-                    self._get_a_ij(self.m_array[j],self.r_array[j],r)
-                ])
-            a_2 = mf.vector_scale(a_2,self.time_step)
-            b_2 = [v_i+a_1i/2 for v_i,a_1i in zip(v,a_1)] # = v(t+a_1/2)Dt
-            b_2 = mf.vector_scale(b_2, self.time_step)
-
-            r_3 = [r_i+b_2i/2 for r_i,b_2i in zip(r,b_2)]   # = r(t)+b_2/2
-            a_3 = [0,0,0]
-            for j in j_range:
-                a_3 = mf.vector_add([
-                    a_3,
-                    self._get_a_ij(self.m_array[j],self.r_array[j],r)
-                ])
-            a_3 = mf.vector_scale(a_3,self.time_step)
-            b_3 = [v_i+a_2i/2 for v_i,a_2i in zip(v,a_2)]
-            b_3 = mf.vector_scale(b_3,self.time_step)
-
-            r_4 = [r_i+b_3i for r_i,b_3i in zip(r,b_3)]
-            a_4 = [0,0,0]
-            for j in j_range:
-                a_4 = mf.vector_add([
-                    a_4,
-                    self._get_a_ij(self.m_array[j],self.r_array[j],r)
-                ])
-            a_4 = mf.vector_scale(a_4,self.time_step)
-            b_4 = [v_i+a_3i/2 for v_i,a_3i in zip(v,a_3)]
-            b_4 = mf.vector_scale(b_4,self.time_step)
-
-            # update v
-            self.v_array[i] = mf.vector_add([
-                    self.v_array[i],
-                    mf.vector_scale(
-                    mf.vector_add([
-                        a_1,
-                        mf.vector_scale(a_2, 2),
-                        mf.vector_scale(a_3, 2),
-                        a_4
-                    ])
-                    , 1/6)
-            ])
-
-            # update r
-            self.r_array[i] = mf.vector_add([
-                    self.r_array[i],
-                    mf.vector_scale(
-                    mf.vector_add([
-                        b_1,
-                        mf.vector_scale(b_2, 2),
-                        mf.vector_scale(b_3, 2),
-                        b_4
-                    ]),
-                    1/6)
-            ])
-
-    def _get_a_ij(self, m2, r1, r2):
-        """Takes mass m  """
-        G = 6.674e-11           # 6.674*10^(−11) N*(m/kg)^2
-        R = [(r1[i]-r2[i]) for i in range(3)]
-        k = G*m2/(mf.norm(R)**3)
-        return [k*R_i for R_i in R]
-
-    def generate_animation(self, show = False, simulation_duration = 10, filename = None):
-        nr_of_objects = self.nr_of_objects
-        x_data = [[x/au for x in array] for array in self.x_data]
-        y_data = [[y/au for y in array] for array in self.y_data]
-        z_data = [[z/au for z in array] for array in self.z_data]
-        data = []
-        for i in range(nr_of_objects):
-            data.append([x_data[i], y_data[i], z_data[i]])
-        for i in range(nr_of_objects):
-            data.append([x_data[i], y_data[i], z_data[i]])
-        data = np.array(data)
-        t_data = [t/day for t in self.t_data]
-        color_array = self.color_data
-        fig = plt.figure(figsize=(10,5), dpi = 100)
-        ax1 = p3.Axes3D(fig)
+        dt = self.time_step
+        r, v = self.r_array, self.v_array    # r(t), v(t)
+
+        # a_1,b_1,...,a_4,b_4
+        a_1 = self._get_accelerations(r)*dt          # = a(r(t))Dt
+        b_1 = v*dt                                  # = v(t)Dt
+        a_2 = self._get_accelerations(r + b_1/2)*dt  # = a(r(t)+b_1/2)Dt
+        b_2 = (v + a_1/2)*dt                        # = (v(t)+a_1/2)Dt
+        a_3 = self._get_accelerations(r + b_2/2)*dt
+        b_3 = (v + a_2/2)*dt
+        a_4 = self._get_accelerations(r + b_3)*dt
+        b_4 = (v + a_3)*dt
+
+        # update v and r
+        v += (a_1 + 2*a_2 + 2*a_3 + a_4)/6
+        r += (b_1 + 2*b_2 + 2*b_3 + b_4)/6
+
+    def dormand_prince_step(self):
+        """Fifth order Runge-Kutta step of Dormand and Prince. The difference
+        to the embedded fourth order solution is kept in _error_estimate and
+        used by adaptive_step(...)."""
+        self.t += self.time_step
+        dt = self.time_step
+        r, v = self.r_array, self.v_array
+        k_r, k_v = [], []       # stage velocities and accelerations
+        for A_i in DORMAND_PRINCE_A:
+            r_i = r + dt*sum(A_ij*k for A_ij, k in zip(A_i, k_r))
+            v_i = v + dt*sum(A_ij*k for A_ij, k in zip(A_i, k_v))
+            k_r.append(v_i)
+            k_v.append(self._get_accelerations(r_i))
+        # the last stage is evaluated at the new state, A[-1] = b
+        self._error_estimate = (
+            dt*sum(e_j*k for e_j, k in zip(DORMAND_PRINCE_E, k_r)),
+            dt*sum(e_j*k for e_j, k in zip(DORMAND_PRINCE_E, k_v))
+        )
+        r[:] = r_i
+        v[:] = v_i
+
+    def _iter_distances(self):
+        """Yields the rows and the distances (rows,nr_of_massive_objects) of
+        the current positions to the massive objects. These are the cached
+        distances of the direct forces if available. Otherwise, with the
+        Barnes-Hut or threaded forces, they are evaluated in blocks of
+        DISTANCE_BLOCK_SIZE rows, so the memory stays linear in N."""
+        r = self.r_array
+        self._get_accelerations(r)
+        if self._cached_distances is not None:
+            yield np.arange(len(r)), self._cached_distances
+            return
+        for start in range(0, len(r), DISTANCE_BLOCK_SIZE):
+            rows = np.arange(start, min(start + DISTANCE_BLOCK_SIZE, len(r)))
+            yield rows, get_distances(r, rows, self.nr_of_massive_objects,
+                    self.softening_length)
+
+    def _get_block_levels(self):
+        """Returns the time step level of every object for block_verlet_step.
+        The step of object i, time_step/2**level_i, is the largest that is at
+        most block_accuracy times the shortest dynamical time
+        sqrt(r_ij**3/(G*(m_i+m_j))) to any other object j."""
+        m = self.m_array
+        steps = np.empty(self.nr_of_objects)
+        for rows, distances in self._iter_distances():
+            with np.errstate(divide='ignore'):
+                dynamical_times = np.sqrt(distances**3
+                        /(G*(m[rows,np.newaxis] + m[np.newaxis,:distances.shape[1]])))
+            steps[rows] = self.block_accuracy*np.min(dynamical_times, axis=1)
+        with np.errstate(divide='ignore'):
+            levels = np.ceil(np.log2(self.time_step/steps))
+        return np.clip(levels, 0, self.max_block_level).astype(int)
+
+    def block_verlet_step(self):
+        """Kick-drift-kick leapfrog with individual time steps. Object i takes
+        steps of time_step/2**level_i, see _get_block_levels(...). All objects
+        are drifted every smallest step, but forces are only evaluated for the
+        objects whose own step ends, so slow outer objects are cheap."""
+        dt = self.time_step
+        r, v = self.r_array, self.v_array
+        levels = self._get_block_levels()
+        max_level = levels.max()
+        nr_of_substeps = 2**max_level
+        dt_i = (dt/2.0**levels)[:,np.newaxis]
+        substeps_per_step = 2**(max_level - levels)
+        # opening half kick
+        v += 1/2*self._get_accelerations(r)*dt_i
+        for n in range(1, nr_of_substeps + 1):
+            r += v*dt/nr_of_substeps
+            active = np.flatnonzero(n % substeps_per_step == 0)
+            if n == nr_of_substeps:
+                # closing half kick of all objects, which are synchronized
+                v += 1/2*self._get_accelerations(r)*dt_i
+            else:
+                # closing and opening half kicks of the active objects
+                v[active] += self._get_accelerations(r, active)*dt_i[active]
+        self.t += dt
+
+    def _kick_drift_kick(self, weights):
+        """Takes velocity Verlet substeps of weights[k]*time_step. Consecutive
+        kicks at the same positions share one force evaluation."""
+        dt = self.time_step
+        r, v = self.r_array, self.v_array
+        for w in weights:
+            v += 1/2*self._get_accelerations(r)*w*dt
+            r += v*w*dt
+            v += 1/2*self._get_accelerations(r)*w*dt
+        self.t += dt
+
+    def _drift_kick_drift(self, weights):
+        """Takes position Verlet substeps of weights[k]*time_step."""
+        dt = self.time_step
+        r, v = self.r_array, self.v_array
+        for w in weights:
+            r += 1/2*v*w*dt
+            v += self._get_accelerations(r)*w*dt
+            r += 1/2*v*w*dt
+        self.t += dt
+
+    def yoshida_4_step(self):
+        """Fourth order symplectic step of Yoshida, three Verlet substeps."""
+        self._kick_drift_kick(YOSHIDA_4_WEIGHTS)
+
+    def yoshida_6_step(self):
+        """Sixth order symplectic step of Yoshida (solution A), seven Verlet
+        substeps."""
+        self._kick_drift_kick(YOSHIDA_6_WEIGHTS)
+
+    def forest_ruth_step(self):
+        """Fourth order symplectic step of Forest and Ruth, three position
+        Verlet substeps."""
+        self._drift_kick_drift(YOSHIDA_4_WEIGHTS)
+
+    def wisdom_holman_step(self):
+        """Wisdom-Holman step in democratic heliocentric coordinates. The
+        Keplerian orbits around the most massive object are solved exactly
+        with kepler_drift(...), and only the interactions between the other
+        objects are integrated, with kicks. With a dominating central object,
+        such as the Sun, much longer steps than with verlet can be taken."""
+        dt = self.time_step
+        r, v, m = self.r_array, self.v_array, self.m_array
+        i_0 = np.argmax(m)
+        others = np.arange(self.nr_of_objects) != i_0
+        m_0, m_others, M = m[i_0], m[others], np.sum(m)
+        r_cm, v_cm = m@r/M, m@v/M
+        # heliocentric positions and barycentric velocities
+        Q = r[others] - r[i_0]
+        P = v[others] - v_cm
+        nr_of_sources = self.nr_of_massive_objects - 1
+        softening_length = self.softening_length
+        P += 1/2*get_accelerations(Q, m_others, nr_of_sources=nr_of_sources,
+                softening_length=softening_length)*dt
+        Q += 1/2*(m_others@P)/m_0*dt
+        Q, P = kepler_drift(Q, P, G*m_0, dt)
+        Q += 1/2*(m_others@P)/m_0*dt
+        P += 1/2*get_accelerations(Q, m_others, nr_of_sources=nr_of_sources,
+                softening_length=softening_length)*dt
+        # back to positions and velocities relative to the origin
+        r_0 = r_cm + v_cm*dt - m_others@Q/M
+        r[i_0] = r_0
+        r[others] = Q + r_0
+        v[i_0] = v_cm - m_others@P/m_0
+        v[others] = P + v_cm
+        self.t += dt
+
+    def _get_encounter_pairs(self):
+        """Returns the pairs of objects closer than encounter_radius as a
+        (P,2) array, closest first. Every object is in at most one pair, and
+        pairs of test particles are skipped."""
+        close_i, close_j, close_distances = [], [], []
+        for rows, distances in self._iter_distances():
+            # every pair once, the source j is massive
+            i, j = np.nonzero(distances < self.encounter_radius)
+            i = rows[i]
+            close_i.append(i[i > j])
+            close_j.append(j[i > j])
+            close_distances.append(distances[i[i > j] - rows[0],j[i > j]])
+        i, j = np.concatenate(close_i), np.concatenate(close_j)
+        pairs, paired = [], set()
+        for k in np.argsort(np.concatenate(close_distances)):
+            if i[k] not in paired and j[k] not in paired:
+                pairs.append((j[k], i[k]))
+                paired.update((i[k], j[k]))
+        return np.array(pairs, dtype=int).reshape(-1,2)
+
+    def _get_pair_accelerations(self, r):
+        """Returns the accelerations (N,3) due to the forces within the
+        encounter pairs only."""
+        i, j = self._encounter_pairs.T
+        m = self.m_array
+        R = r[j] - r[i]
+        k = G/(np.einsum('ij,ij->i', R, R) + self.softening_length**2)**(3/2)
+        a = np.zeros(r.shape)
+        a[i] = (k*m[j])[:,np.newaxis]*R
+        a[j] = -(k*m[i])[:,np.newaxis]*R
+        return a
+
+    def _kepler_drift_pairs(self, pairs, dt):
+        """Advances the relative motion of the pairs by dt along their
+        Keplerian orbits, at fixed centers of mass."""
+        i, j = pairs.T
+        r, v, m = self.r_array, self.v_array, self.m_array
+        M = (m[i] + m[j])[:,np.newaxis]
+        m_i, m_j = m[i][:,np.newaxis], m[j][:,np.newaxis]
+        r_cm, v_cm = (m_i*r[i] + m_j*r[j])/M, (m_i*v[i] + m_j*v[j])/M
+        R, V = kepler_drift(r[j] - r[i], v[j] - v[i], G*M[:,0], dt)
+        r[i], r[j] = r_cm - m_j/M*R, r_cm + m_i/M*R
+        v[i], v[j] = v_cm - m_j/M*V, v_cm + m_i/M*V
+
+    def encounter_step(self):
+        """Takes a step of method_function, with the pairs of objects closer
+        than encounter_radius split off as Keplerian two body problems, which
+        are solved exactly with kepler_drift(...) for half a step before and
+        after. In between, method_function moves both objects of a pair with
+        their center of mass velocity and kicks them with the forces of the
+        other objects only. A close encounter then neither blows up nor needs
+        a short time_step. Without close pairs this is method_function."""
+        pairs = self._get_encounter_pairs()
+        if len(pairs) == 0:
+            self.method_function()
+            return
+        dt = self.time_step
+        i, j = pairs.T
+        v, m = self.v_array, self.m_array
+        M = (m[i] + m[j])[:,np.newaxis]
+        m_i, m_j = m[i][:,np.newaxis], m[j][:,np.newaxis]
+        self._kepler_drift_pairs(pairs, dt/2)
+        V = v[j] - v[i]
+        v[i] = v[j] = (m_i*v[i] + m_j*v[j])/M
+        self._encounter_pairs = pairs
+        try:
+            self.method_function()
+        finally:
+            self._encounter_pairs = None
+        # the other objects kick both objects of a pair differently
+        V += v[j] - v[i]
+        v_cm = (m_i*v[i] + m_j*v[j])/M
+        v[i], v[j] = v_cm - m_j/M*V, v_cm + m_i/M*V
+        self._kepler_drift_pairs(pairs, dt/2)
+
+    def adaptive_step(self):
+        """Takes one step with method_function, or encounter_step() with
+        encounter_radius, and error controlled step size. Dormand-Prince uses
+        its embedded error estimate, the other methods estimate the error by
+        comparing one full step with two half steps. Rejected steps are
+        retaken with a smaller time_step, and time_step is updated for the
+        next step."""
+        order = METHOD_ORDERS[self.method]
+        step_function = self._get_fixed_step_function()
+        r, v = self.r_array, self.v_array
+        while True:
+            t_0, r_0, v_0 = self.t, np.copy(r), np.copy(v)
+            dt = min(self.time_step, self.t_end - self.t)
+            if dt <= 1e-12*max(abs(self.t), self.t_end):
+                raise RuntimeError('Step size underflow at t = %g s' % self.t)
+            self.time_step = dt
+            if self.method == 'dormand-prince':
+                step_function()
+                error_r, error_v = self._error_estimate
+            else:
+                step_function()
+                r_1, v_1 = np.copy(r), np.copy(v)
+                self.t, r[:], v[:] = t_0, r_0, v_0
+                self.time_step = dt/2
+                step_function()
+                step_function()
+                error_r = (r - r_1)/(2**order - 1)
+                error_v = (v - v_1)/(2**order - 1)
+            # error relative to each object's position and velocity, with the
+            # mean over all objects as floor for objects at rest in the origin
+            r_norm = np.linalg.norm(r_0, axis=-1)
+            v_norm = np.linalg.norm(v_0, axis=-1)
+            error = max(
+                np.max(np.linalg.norm(error_r, axis=-1)/(r_norm + np.mean(r_norm))),
+                np.max(np.linalg.norm(error_v, axis=-1)/(v_norm + np.mean(v_norm)))
+            )/self.tolerance
+            factor = min(5, max(0.2, 0.9*error**(-1/(order + 1)))) if error > 0 else 5
+            self.time_step = dt*factor
+            if error <= 1: return
+            self.t, r[:], v[:] = t_0, r_0, v_0
+
+    def __getstate__(self):
+        """Returns the attributes to pickle, e.g. for run_sweep(...). The
+        timed wrappers of start_profiling() are local functions and are left
+        out, so a copy of a profiled simulation keeps the stats so far but is
+        not profiled."""
+        state = dict(self.__dict__)
+        if self._profile is not None and self._profile['start'] is not None:
+            for name in PROFILED_METHODS:
+                del state[name]
+            profile = dict(self._profile)
+            profile['wall_time'] += time.perf_counter() - profile['start']
+            profile['start'] = None
+            state['_profile'] = profile
+        return state
+
+    def start_profiling(self):
+        """Starts timing the phases of PROFILED_METHODS and counting the force
+        evaluations, pair interactions, steps, samples and recorded bytes,
+        see stats(). The methods are replaced by timed wrappers on this
+        object until stop_profiling(), so there is no overhead otherwise."""
+        self.stop_profiling()
+        self._profile = {
+            'start': time.perf_counter(),
+            'wall_time': 0,
+            'times': dict.fromkeys(PROFILED_METHODS.values(), 0.0),
+            'counters': dict.fromkeys(['force_evaluations', 'pair_interactions',
+                    'steps', 'samples', 'bytes_recorded'], 0)
+        }
+        nested = []     # time of the nested profiled calls, per open call
+        for name, phase in PROFILED_METHODS.items():
+            setattr(self, name, self._get_profiled_method(name, phase, nested))
 
-        ax1.set_xlim(-5, 5)
-        ax1.set_ylim(-5, 5)
-        ax1.set_zlim(-5, 5)
-        ax1.set_xlabel('x')
-        ax1.set_ylabel('y')
-        ax1.set_zlabel('z')
-        lines = []
+    def stop_profiling(self):
+        """Restores the methods replaced by start_profiling(). The stats are
+        kept."""
+        if self._profile is None or self._profile['start'] is None: return
+        for name in PROFILED_METHODS:
+            del self.__dict__[name]
+        self._profile['wall_time'] += time.perf_counter() - self._profile['start']
+        self._profile['start'] = None
 
+    @contextlib.contextmanager
+    def profiling(self):
+        """Context manager that profiles the simulation within it, see
+        start_profiling()."""
+        self.start_profiling()
+        try:
+            yield self
+        finally:
+            self.stop_profiling()
+
+    def _get_profiled_method(self, name, phase, nested):
+        """Returns the method name wrapped to add its time, without that of
+        the nested profiled calls, to phase, and to update the counters."""
+        method = getattr(self, name)
+        times, counters = self._profile['times'], self._profile['counters']
+        def profiled(*args, **kwargs):
+            step, nr_of_samples, cached_a = self._step, self.nr_of_samples, self._cached_a
+            nested.append(0)
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                times[phase] += elapsed - nested.pop()
+                if nested: nested[-1] += elapsed
+                if name == '_get_accelerations':
+                    targets = args[1] if len(args) > 1 else kwargs.get('targets')
+                    # calls answered from the cache evaluate no forces
+                    if targets is not None or self._cached_a is not cached_a:
+                        N_m, members = self.nr_of_massive_objects, self.r_array[...,0,0].size
+                        # without the pairs of a massive target with itself
+                        if targets is None:
+                            rows, self_pairs = self.nr_of_objects, N_m
+                        else:
+                            targets = np.asarray(targets)
+                            rows, self_pairs = len(targets), int(np.count_nonzero(targets < N_m))
+                        counters['force_evaluations'] += 1
+                        counters['pair_interactions'] += members*(rows*N_m - self_pairs)
+                elif name == '_take_step':
+                    counters['steps'] += 1
+                elif name in ('_store_positions', '_execute_jit_kernels'):
+                    samples = self.nr_of_samples - nr_of_samples
+                    sample_size = self.r_array.nbytes + 8
+                    if self._v_data is not None: sample_size += self.v_array.nbytes
+                    if self.track_energy: sample_size += 3*8
+                    counters['samples'] += samples
+                    counters['bytes_recorded'] += samples*sample_size
+                    if name == '_execute_jit_kernels':
+                        counters['steps'] += self._step - step
+        return profiled
+
+    def stats(self):
+        """Returns the profile of start_profiling() as a dict. 'times' holds
+        the time of every phase in s, and 'other' the rest of the profiled
+        'wall_time'. The forces of the compiled kernels and of the
+        wisdom-holman kicks are not evaluated by _get_accelerations(...), they
+        are part of the 'compiled kernels' and 'state update' phases and are
+        not counted. The counters are 'force_evaluations',
+        'pair_interactions' (of the direct sum), 'steps', 'samples' and
+        'bytes_recorded'."""
+        if self._profile is None:
+            raise ValueError('The simulation was not profiled, see start_profiling()')
+        wall_time = self._profile['wall_time']
+        if self._profile['start'] is not None:
+            wall_time += time.perf_counter() - self._profile['start']
+        times = dict(self._profile['times'])
+        times['other'] = wall_time - sum(times.values())
+        stats = {'wall_time': wall_time, 'times': times}
+        stats.update(self._profile['counters'])
+        return stats
+
+    def generate_animation(self, show = False, simulation_duration = 10, filename = None,
+            n_workers = 1):
+        """Animates the trajectories in 3D. The positions are interpolated at
+        the frame times with positions_at(...), so the frames are evenly
+        spaced in time however the run was stored. With filename the movie
+        is rendered off screen, see rendering.render_movie(...), with
+        n_workers worker processes rendering ranges of frames."""
+        # matplotlib is only imported for plotting, the integration does not
+        # need it
+        import rendering
         # Regulate real-time duration of Simulation
         simulation_duration = simulation_duration // 2 + 1
         number_of_frames = simulation_duration*1000 // 30
-        i_step = len(t_data) / number_of_frames
-
-        for i, dat in enumerate(data):  # grey lines
-            if i < nr_of_objects:
-                l = ax1.plot(dat[0,0:1],dat[1,0:1],dat[2,0:1],
-                        linewidth = 0.5,
-                        color = [0.5,0.5,0.5])[0]
-                lines.append(l)
-            else:
-                l = ax1.plot([dat[0,1]],[dat[1,1]],[dat[2,1]],
-                        markersize = 10,
-                        marker = '.',
-                        c = color_array[i%nr_of_objects])[0]
-                lines.append(l)
-
-        def animate(i, data_lines, lines):
-            end_index = int(i*i_step)
-            for j, line, data in zip(range(len(lines)), lines, data_lines):
-                if j < nr_of_objects:
-                    line.set_data(data[0:2,:end_index])
-                    line.set_3d_properties(data[2,:end_index])
-                else:
-                    line.set_data(data[0:2,end_index])
-                    line.set_3d_properties(data[2,end_index])
-            return lines
 
-        anim = animation.FuncAnimation(fig, animate, fargs=(data,lines),
-                    interval=30, blit=True, frames = number_of_frames)
+        if self.trajectory_directory:
+            # read only the samples around the frame times from disk
+            streamed = self.load_trajectory()
+            t_data = streamed.t_data
+            positions_at = streamed.positions_at
+        else:
+            t_data = self.t_data
+            positions_at = self.positions_at
+        frame_times = np.linspace(t_data[0], t_data[-1], number_of_frames)
+        positions = positions_at(frame_times)/au
+        color_array = self.color_data
         if filename:
-            anim.save(filename, dpi=100, writer='imagemagick')
+            rendering.render_movie(filename, positions, color_array, 30, n_workers)
             print('File succesfully saved.')
-        if show: plt.show()
+        if show:
+            import matplotlib.pyplot as plt
+            import matplotlib.animation as animation
+            fig = plt.figure(figsize=(10,5), dpi = 100)
+            fig, lines = rendering.create_figure(positions, color_array, fig)
+            anim = animation.FuncAnimation(fig, rendering.draw_frame,
+                    fargs=(lines, positions), interval=30, blit=True,
+                    frames=number_of_frames)
+            plt.show()
 
     def generate_energy_animation(self, show = False, simulation_duration = 10):
         """Not yet implemented"""
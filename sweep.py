@@ -0,0 +1,150 @@
+import concurrent.futures
+from multiprocessing import shared_memory
+import numpy as np
+
+def run_sweep(simulations, max_workers = None):
+    """Executes independent simulations, e.g. with different methods, time
+    steps or t_end, in parallel worker processes. The workers write the
+    trajectories and energies directly into shared memory blocks allocated
+    here, so only the small final state is sent back. The simulations are
+    updated in place with the results, as if execute_simulation() had been
+    called on each of them, and are also returned as a list.
+
+    Simulations with a trajectory_file write their positions to that file
+    instead. With adaptive_time_step, where the number of samples is not
+    known beforehand, and with a trajectory_directory, which holds most of
+    the samples, the results are sent back from the worker."""
+    simulations = list(simulations)
+    # every block is released at the end, also when a worker fails
+    all_blocks = []
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+            futures = {}
+            for simulation in simulations:
+                blocks = {}
+                all_blocks.append(blocks)
+                _allocate_shared_memory(simulation, blocks)
+                names = {key: (block.name, shape) for key, (block, shape) in blocks.items()}
+                future = executor.submit(_execute_in_shared_memory, simulation, names)
+                futures[future] = (simulation, blocks)
+            for future in concurrent.futures.as_completed(futures):
+                simulation, blocks = futures[future]
+                _collect_results(simulation, blocks, future.result())
+    finally:
+        for blocks in all_blocks:
+            for block, _ in blocks.values():
+                block.close()
+                block.unlink()
+    return simulations
+
+def _get_nr_of_samples(simulation):
+    """Returns the number of samples execute_simulation() stores, or None if
+    it is not known beforehand."""
+    if simulation.adaptive_time_step or simulation.trajectory_directory: return None
+    nr_of_steps = max(int(np.ceil((simulation.t_end - simulation.t)/simulation.time_step)), 0)
+    return simulation.nr_of_samples + nr_of_steps//simulation.record_every + 2
+
+def _allocate_shared_memory(simulation, blocks):
+    """Allocates the shared memory blocks for the results of simulation into
+    the dict blocks, as (block, shape) with the keys 'r', 'v', 't' and
+    'energy'."""
+    capacity = _get_nr_of_samples(simulation)
+    if capacity is None: return
+    shapes = {'t': (capacity,)}
+    if not simulation.trajectory_file:
+        shapes['r'] = (capacity,) + simulation.r_array.shape
+    if simulation.dense_output:
+        shapes['v'] = (capacity,) + simulation.v_array.shape
+    if simulation.track_energy:
+        shapes['energy'] = (capacity, 3)
+    for key, shape in shapes.items():
+        size = max(int(np.prod(shape))*8, 1)
+        blocks[key] = (shared_memory.SharedMemory(create=True, size=size), shape)
+
+def _attach(name, shape):
+    """Returns the shared memory block name and a float64 array of the given
+    shape backed by it."""
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=float, buffer=block.buf)
+
+def _execute_in_shared_memory(simulation, names):
+    """Runs in a worker process. Executes simulation with its trajectory
+    buffers backed by the shared memory blocks names, and returns the final
+    state and, for results that did not fit, the arrays themselves."""
+    blocks = {key: _attach(name, shape) for key, (name, shape) in names.items()}
+    arrays = {key: array for key, (_, array) in blocks.items()}
+    n = simulation.nr_of_samples
+    if 't' in arrays:
+        if simulation.trajectory_file:
+            # memory map the positions to the file
+            simulation._reserve_samples(len(arrays['t']))
+        else:
+            if n: arrays['r'][:n] = simulation._r_data[:n]
+            simulation._r_data = arrays['r']
+        if n: arrays['t'][:n] = simulation._t_data[:n]
+        simulation._t_data = arrays['t']
+    if 'v' in arrays:
+        if n and simulation._v_data is not None: arrays['v'][:n] = simulation._v_data[:n]
+        simulation._v_data = arrays['v']
+    simulation.execute_simulation()
+
+    n = simulation.nr_of_samples - simulation._first_sample
+    result = {
+        't': simulation.t,
+        'time_step': simulation.time_step,
+        'nr_of_samples': simulation.nr_of_samples,
+        'first_sample': simulation._first_sample,
+        'r_array': np.array(simulation.r_array),
+        'v_array': np.array(simulation.v_array),
+        'event_data': simulation.event_data,
+        'terminated_by': simulation.terminated_by
+    }
+    energies = np.column_stack([simulation.potential_energy_data,
+            simulation.kinetic_energy_data, simulation.total_energy_data])
+    if 'energy' in arrays and len(energies) <= len(arrays['energy']):
+        arrays['energy'][:len(energies)] = energies
+    elif simulation.track_energy:
+        result['energy'] = energies
+    # the buffers were reallocated if the samples did not fit
+    if simulation._t_data is not arrays.get('t'):
+        result['t_data'] = np.array(simulation._t_data[:n])
+    if not simulation.trajectory_file and simulation._r_data is not arrays.get('r'):
+        result['r_data'] = np.array(simulation._r_data[:n])
+    if simulation._v_data is not None and simulation._v_data is not arrays.get('v'):
+        result['v_data'] = np.array(simulation._v_data[:n])
+    del arrays, simulation
+    for block, _ in blocks.values():
+        block.close()
+    return result
+
+def _collect_results(simulation, blocks, result):
+    """Copies the results of a worker from its shared memory blocks and the
+    returned result into simulation."""
+    simulation.t = result['t']
+    simulation.time_step = result['time_step']
+    simulation.r_array = result['r_array']
+    simulation.v_array = result['v_array']
+    simulation.event_data = result['event_data']
+    simulation.terminated_by = result['terminated_by']
+    simulation.nr_of_samples = result['nr_of_samples']
+    simulation._first_sample = result['first_sample']
+    n = simulation.nr_of_samples - simulation._first_sample
+    arrays = {key: np.ndarray(shape, dtype=float, buffer=block.buf)
+            for key, (block, shape) in blocks.items()}
+    t_data = result.get('t_data', arrays.get('t'))
+    simulation._t_data = np.array(t_data[:n])
+    if simulation.trajectory_file:
+        simulation._r_data = np.load(simulation.trajectory_file, mmap_mode='r+')
+    else:
+        r_data = result.get('r_data', arrays.get('r'))
+        simulation._r_data = np.array(r_data[:n])
+    if simulation.dense_output:
+        v_data = result.get('v_data', arrays.get('v'))
+        simulation._v_data = np.array(v_data[:n])
+    if simulation.track_energy:
+        energies = result.get('energy', arrays.get('energy'))
+        energies = np.array(energies[:n])
+        simulation.potential_energy_data = list(energies[:,0])
+        simulation.kinetic_energy_data = list(energies[:,1])
+        simulation.total_energy_data = list(energies[:,2])
+    del arrays
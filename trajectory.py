@@ -0,0 +1,211 @@
+import json
+import os
+import re
+import numpy as np
+
+# Kinds of the chunk files, see _get_chunk_path(...)
+CHUNK_KINDS = ['t', 'r', 'v', 'energy']
+
+def _get_chunk_path(directory, kind, k):
+    """Returns the path of chunk k of kind 't', 'r', 'v' or 'energy'."""
+    return os.path.join(directory, '%s_%06d.npy' % (kind, k))
+
+def hermite_interpolation(theta, dt, r_0, v_0, r_1, v_1):
+    """Returns the positions and velocities at the fraction theta of a step
+    of dt from r_0, v_0 to r_1, v_1, interpolated with cubic Hermite
+    polynomials. theta broadcasts against the leading dimensions."""
+    theta = np.asarray(theta)[...,np.newaxis]
+    theta_2, theta_3 = theta**2, theta**3
+    r = ((2*theta_3 - 3*theta_2 + 1)*r_0 + (theta_3 - 2*theta_2 + theta)*dt*v_0
+            + (3*theta_2 - 2*theta_3)*r_1 + (theta_3 - theta_2)*dt*v_1)
+    v = ((6*theta_2 - 6*theta)*r_0/dt + (3*theta_2 - 4*theta + 1)*v_0
+            + (6*theta - 6*theta_2)*r_1/dt + (3*theta_2 - 2*theta)*v_1)
+    return r, v
+
+def interpolate_positions(times, t_data, get_samples):
+    """Returns the positions at times, interpolated between the samples at
+    the sorted t_data, with hermite_interpolation(...) where velocities are
+    stored and linearly otherwise, also between samples whose velocities
+    are NaN, e.g. those stored before dense_output was set. get_samples(k)
+    returns the positions and velocities, or None, of the samples with
+    indices k."""
+    times = np.asarray(times, dtype=float)
+    if len(t_data) == 0 or np.any(times < t_data[0]) or np.any(times > t_data[-1]):
+        raise ValueError('times must be within the stored samples')
+    k_0 = np.clip(np.searchsorted(t_data, times, side='right') - 1, 0, len(t_data) - 1)
+    k_1 = np.minimum(k_0 + 1, len(t_data) - 1)
+    dt = t_data[k_1] - t_data[k_0]
+    theta = np.where(dt > 0, times - t_data[k_0], 0)/np.where(dt > 0, dt, 1)
+    r_0, v_0 = get_samples(k_0)
+    r_1, v_1 = get_samples(k_1)
+    # theta and dt broadcast against the samples
+    shape = theta.shape + (1,)*(r_0.ndim - theta.ndim - 1)
+    theta, dt = theta.reshape(shape), np.where(dt > 0, dt, 1).reshape(shape + (1,))
+    r_linear = (1 - theta[...,np.newaxis])*r_0 + theta[...,np.newaxis]*r_1
+    if v_0 is None: return r_linear
+    r = hermite_interpolation(theta, dt, r_0, v_0, r_1, v_1)[0]
+    no_velocities = np.isnan(v_0) | np.isnan(v_1)
+    return np.where(no_velocities, r_linear, r)
+
+class TrajectoryWriter():
+    """Writes the samples of a simulation to directory in chunks, every chunk
+    is stored as .npy files of the times, positions and optionally
+    velocities and energies.
+    metadata.json lists the chunks and whether all of them have velocities
+    and energies, and is replaced after every chunk, so an interrupted run
+    leaves a readable trajectory. With nr_of_samples > 0 the existing
+    trajectory is continued after its first nr_of_samples samples, e.g.
+    when resuming from a checkpoint. The chunk files of an earlier run that
+    are not continued are deleted."""
+
+    def __init__(self, directory, name_array, color_data, area_data, nr_of_samples = 0):
+        self.directory = str(directory)
+        os.makedirs(self.directory, exist_ok=True)
+        chunk_sizes, has_velocities, has_energies = [], False, False
+        if nr_of_samples:
+            metadata = self._read_metadata()
+            chunk_sizes = metadata['chunk_sizes']
+            has_velocities, has_energies = metadata['has_velocities'], metadata['has_energies']
+            # drop the chunks written after nr_of_samples
+            chunk_sizes = chunk_sizes[:np.searchsorted(np.cumsum(chunk_sizes), nr_of_samples) + 1]
+            if sum(chunk_sizes) != nr_of_samples:
+                raise ValueError('No chunk of %s ends at sample %d' % (self.directory, nr_of_samples))
+        self.metadata = {
+            'name_array': list(name_array),
+            'color_data': list(color_data),
+            'area_data': list(area_data),
+            'chunk_sizes': chunk_sizes,
+            'has_velocities': has_velocities,
+            'has_energies': has_energies
+        }
+        self._write_metadata()
+        self._remove_chunks(len(chunk_sizes))
+
+    def _remove_chunks(self, first_chunk):
+        """Deletes the chunk files of the chunks from first_chunk on."""
+        pattern = re.compile(r'(%s)_(\d{6})\.npy$' % '|'.join(CHUNK_KINDS))
+        for filename in os.listdir(self.directory):
+            match = pattern.match(filename)
+            if match and int(match.group(2)) >= first_chunk:
+                os.remove(os.path.join(self.directory, filename))
+
+    def _read_metadata(self):
+        with open(os.path.join(self.directory, 'metadata.json')) as file:
+            return json.load(file)
+
+    def _write_metadata(self):
+        path = os.path.join(self.directory, 'metadata.json')
+        with open(path + '.tmp', 'w') as file:
+            json.dump(self.metadata, file, default=lambda x: np.asarray(x).tolist())
+        os.replace(path + '.tmp', path)
+
+    def write(self, t_data, r_data, energy_data = None, v_data = None):
+        """Appends a chunk with the times t_data (n,), positions r_data (n,N,3),
+        the energies energy_data (n,3), potential, kinetic and total, and the
+        velocities v_data (n,N,3)."""
+        k = len(self.metadata['chunk_sizes'])
+        np.save(_get_chunk_path(self.directory, 't', k), t_data)
+        np.save(_get_chunk_path(self.directory, 'r', k), r_data)
+        if v_data is not None:
+            np.save(_get_chunk_path(self.directory, 'v', k), v_data)
+        if energy_data is not None:
+            np.save(_get_chunk_path(self.directory, 'energy', k), energy_data)
+        for key, data in (('has_velocities', v_data), ('has_energies', energy_data)):
+            self.metadata[key] = (k == 0 or self.metadata[key]) and data is not None
+        self.metadata['chunk_sizes'].append(len(t_data))
+        self._write_metadata()
+
+class Trajectory():
+    """Lazy reader of a trajectory written by TrajectoryWriter, for runs that
+    do not fit into memory. Only the times are loaded up front, positions and
+    energies are read on demand from memory mapped chunks, per time window,
+    per object or per sample."""
+
+    def __init__(self, directory):
+        self.directory = str(directory)
+        with open(os.path.join(self.directory, 'metadata.json')) as file:
+            metadata = json.load(file)
+        self.name_array = metadata['name_array']
+        self.color_data = metadata['color_data']
+        self.area_data = metadata['area_data']
+        self.nr_of_objects = len(self.name_array)
+        self._chunk_ends = np.cumsum(metadata['chunk_sizes'], dtype=int)
+        self.nr_of_samples = int(self._chunk_ends[-1]) if len(self._chunk_ends) else 0
+        # velocities are stored by simulations with dense_output
+        self.has_velocities = metadata['has_velocities']
+        self.has_energies = metadata['has_energies']
+        self._t_data = None
+
+    @property
+    def t_data(self):
+        """Times of all samples, loaded on first access."""
+        if self._t_data is None:
+            self._t_data = np.concatenate([np.empty(0)] + [np.load(_get_chunk_path(
+                    self.directory, 't', k)) for k in range(len(self._chunk_ends))])
+            self._t_data.flags.writeable = False
+        return self._t_data
+
+    def _get_object_indices(self, objects):
+        """Returns the indices of objects, given by index or name, None for
+        all objects."""
+        if objects is None: return np.arange(self.nr_of_objects)
+        return np.array([self.name_array.index(i) if isinstance(i, str) else i
+                for i in objects], dtype=int)
+
+    def _read(self, kind, samples, shape, select = lambda x: x):
+        """Returns the rows samples of the chunks of kind, with select applied
+        to the rows of every chunk."""
+        samples = np.arange(self.nr_of_samples)[samples if samples is not None else slice(None)]
+        samples = np.atleast_1d(samples)
+        data = np.empty((len(samples),) + shape)
+        chunks = np.searchsorted(self._chunk_ends, samples, side='right')
+        for k in np.unique(chunks):
+            selected = chunks == k
+            chunk = np.load(_get_chunk_path(self.directory, kind, k), mmap_mode='r')
+            first_sample = self._chunk_ends[k] - len(chunk)
+            data[selected] = select(chunk[samples[selected] - first_sample])
+        return data
+
+    def get_positions(self, samples = None, objects = None):
+        """Returns the positions (samples, objects, 3) of the given samples,
+        an index array or slice, and objects, indices or names. None selects
+        all samples or objects."""
+        objects = self._get_object_indices(objects)
+        return self._read('r', samples, (len(objects), 3), lambda r: r[:,objects])
+
+    def get_velocities(self, samples = None, objects = None):
+        """Returns the velocities of the given samples and objects, if they
+        were stored, see get_positions(...)."""
+        if not self.has_velocities:
+            raise ValueError('No velocities are stored in %s' % self.directory)
+        objects = self._get_object_indices(objects)
+        return self._read('v', samples, (len(objects), 3), lambda v: v[:,objects])
+
+    def positions_at(self, times, objects = None):
+        """Returns the positions (times, objects, 3) at any times within the
+        run, interpolated between the stored samples, see
+        interpolate_positions(...). Only the samples around times are read."""
+        def get_samples(k):
+            r = self.get_positions(k, objects)
+            v = self.get_velocities(k, objects) if self.has_velocities else None
+            if np.ndim(k) == 0: return r[0], v if v is None else v[0]
+            return r, v
+        return interpolate_positions(times, self.t_data, get_samples)
+
+    def get_object(self, i):
+        """Returns the positions (samples,3) of object i, index or name."""
+        return self.get_positions(objects=[i])[:,0]
+
+    def get_window(self, t_start, t_end, objects = None):
+        """Returns the times and positions of the samples with t_start <= t <=
+        t_end, see get_positions(...)."""
+        samples = np.flatnonzero((self.t_data >= t_start) & (self.t_data <= t_end))
+        return self.t_data[samples], self.get_positions(samples, objects)
+
+    def get_energies(self, samples = None):
+        """Returns the potential, kinetic and total energies of the given
+        samples, if they were tracked."""
+        if not self.has_energies:
+            raise ValueError('No energies are stored in %s' % self.directory)
+        energies = self._read('energy', samples, (3,))
+        return energies[:,0], energies[:,1], energies[:,2]